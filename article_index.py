@@ -0,0 +1,165 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import Counter
+from db import get_database
+from text_utils import content_terms
+
+logger = logging.getLogger(__name__)
+
+# Expired articles are pruned once every this many additions
+PRUNE_EVERY = 100
+
+
+def _topic_key(topic):
+    return " ".join(topic.split()).lower()
+
+
+class ArticleIndex:
+    # Full-text index over every article extract_clean_text has produced, with
+    # its URL and fetch time, so new plans can be built from what was already
+    # downloaded. Uses SQLite FTS5 where available and a plain inverted index
+    # table otherwise.
+    def __init__(self, path, max_age=30 * 86400):
+        self.path = path
+        self.max_age = max_age
+        self.db = get_database(path)
+        self.hits = 0
+        self.misses = 0
+        self._added = 0
+        self._lock = threading.Lock()
+
+        with self.db.connect() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS articles (
+                url TEXT PRIMARY KEY,
+                text TEXT,
+                content_hash TEXT,
+                fetched_at REAL
+            )''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_articles_fetched_at ON articles(fetched_at)')
+            # Running totals for stats(), so a metrics scrape does not scan the articles
+            conn.execute('''CREATE TABLE IF NOT EXISTS article_totals (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                entries INTEGER,
+                bytes INTEGER
+            )''')
+            conn.execute('''INSERT OR IGNORE INTO article_totals (id, entries, bytes)
+                            SELECT 0, COUNT(*), COALESCE(SUM(LENGTH(CAST(text AS BLOB))), 0) FROM articles''')
+            # The URL list each topic's plans were built from, in slice order
+            conn.execute('''CREATE TABLE IF NOT EXISTS source_pools (
+                topic TEXT PRIMARY KEY,
+                urls TEXT,
+                created_at REAL
+            )''')
+            try:
+                conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS article_text USING fts5(url UNINDEXED, text, tokenize='porter unicode61')")
+                self.fts = True
+            except sqlite3.OperationalError:
+                logger.info("SQLite has no FTS5, using the inverted index table")
+                conn.execute('''CREATE TABLE IF NOT EXISTS article_terms (
+                    term TEXT,
+                    url TEXT,
+                    count INTEGER,
+                    PRIMARY KEY (term, url)
+                )''')
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_article_terms_url ON article_terms(url)')
+                self.fts = False
+
+    def add(self, url, text, content_hash=None):
+        if not text or not text.strip():
+            return
+        size = len(text.encode("utf-8"))
+        with self.db.connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            old = conn.execute('SELECT LENGTH(CAST(text AS BLOB)) FROM articles WHERE url = ?', (url,)).fetchone()
+            conn.execute('INSERT OR REPLACE INTO articles (url, text, content_hash, fetched_at) VALUES (?, ?, ?, ?)',
+                         (url, text, content_hash, time.time()))
+            conn.execute('UPDATE article_totals SET entries = entries + ?, bytes = bytes + ? WHERE id = 0',
+                         (0 if old else 1, size - (old[0] if old else 0)))
+            if self.fts:
+                conn.execute('DELETE FROM article_text WHERE url = ?', (url,))
+                conn.execute('INSERT INTO article_text (url, text) VALUES (?, ?)', (url, text))
+            else:
+                conn.execute('DELETE FROM article_terms WHERE url = ?', (url,))
+                conn.executemany('INSERT INTO article_terms (term, url, count) VALUES (?, ?, ?)',
+                                 [(term, url, count) for term, count in Counter(content_terms(text)).items()])
+        with self._lock:
+            self._added += 1
+            prune = self._added % PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    def search(self, query, limit):
+        # URLs of fresh articles that contain every term of the query, best match first
+        terms = list(dict.fromkeys(content_terms(query)))
+        if not terms or limit <= 0:
+            return []
+        since = time.time() - self.max_age
+        with self.db.connect() as conn:
+            if self.fts:
+                match = " ".join(f'"{term}"' for term in terms)
+                rows = conn.execute('''SELECT article_text.url FROM article_text
+                                       JOIN articles ON articles.url = article_text.url
+                                       WHERE article_text MATCH ? AND articles.fetched_at > ?
+                                       ORDER BY bm25(article_text) LIMIT ?''', (match, since, limit)).fetchall()
+            else:
+                placeholders = ", ".join("?" for _ in terms)
+                rows = conn.execute(f'''SELECT article_terms.url FROM article_terms
+                                        JOIN articles ON articles.url = article_terms.url
+                                        WHERE term IN ({placeholders}) AND articles.fetched_at > ?
+                                        GROUP BY article_terms.url HAVING COUNT(*) = ?
+                                        ORDER BY SUM(count) DESC LIMIT ?''', (*terms, since, len(terms), limit)).fetchall()
+        urls = [row[0] for row in rows]
+        with self._lock:
+            if urls:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return urls
+
+    def saved_pool(self, topic):
+        with self.db.connect() as conn:
+            row = conn.execute('SELECT urls FROM source_pools WHERE topic = ? AND created_at > ?',
+                               (_topic_key(topic), time.time() - self.max_age)).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def save_pool(self, topic, urls):
+        with self.db.connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO source_pools (topic, urls, created_at) VALUES (?, ?, ?)',
+                         (_topic_key(topic), json.dumps(urls), time.time()))
+
+    def text(self, url):
+        with self.db.connect() as conn:
+            row = conn.execute('SELECT text FROM articles WHERE url = ? AND fetched_at > ?',
+                               (url, time.time() - self.max_age)).fetchone()
+        return row[0] if row else None
+
+    def prune(self):
+        since = time.time() - self.max_age
+        with self.db.connect() as conn:
+            rows = conn.execute('SELECT url, LENGTH(CAST(text AS BLOB)) FROM articles WHERE fetched_at <= ?',
+                                (since,)).fetchall()
+            if not rows:
+                return 0
+            params = [(row[0],) for row in rows]
+            conn.executemany('DELETE FROM articles WHERE url = ?', params)
+            if self.fts:
+                conn.executemany('DELETE FROM article_text WHERE url = ?', params)
+            else:
+                conn.executemany('DELETE FROM article_terms WHERE url = ?', params)
+            conn.execute('UPDATE article_totals SET entries = entries - ?, bytes = bytes - ? WHERE id = 0',
+                         (len(rows), sum(row[1] or 0 for row in rows)))
+        return len(rows)
+
+    def stats(self):
+        with self.db.connect() as conn:
+            count, size = conn.execute('SELECT entries, bytes FROM article_totals WHERE id = 0').fetchone()
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": count,
+                "bytes": size,
+            }
@@ -0,0 +1,421 @@
+# Offline benchmark for the plan-generation pipeline and the Flask routes.
+#
+# SerpAPI, page downloads and OpenAI are replaced by local stand-ins that
+# answer from the recorded responses in benchmark_fixtures/ after an injected
+# delay, so the numbers only depend on this code and the chosen latencies.
+# All caches and the app database live in a temporary directory.
+#
+#   python benchmark.py
+#   python benchmark.py --llm-latency 0 --serp-latency 0 --page-latency 0 --json bench.json
+
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(REPO_DIR, "benchmark_fixtures")
+
+
+def _fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+
+# -------------------------- Measurements --------------------------
+class StageTimer:
+    # Collects wall-clock durations per stage from any number of threads
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def wrap(self, module, name, stage):
+        fn = getattr(module, name)
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - started)
+
+        setattr(module, name, timed)
+
+    def reset(self):
+        with self._lock:
+            self.samples = {}
+
+    def summary(self):
+        with self._lock:
+            return {stage: percentiles(samples) for stage, samples in sorted(self.samples.items())}
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+
+    def nearest_rank(q):
+        return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+
+    return {
+        "count": len(ordered),
+        "p50_ms": nearest_rank(0.50) * 1000,
+        "p90_ms": nearest_rank(0.90) * 1000,
+        "p99_ms": nearest_rank(0.99) * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+# -------------------------- Stand-ins --------------------------
+class Latency:
+    def __init__(self, seconds, jitter, seed):
+        self.seconds = seconds
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sleep(self):
+        if self.seconds <= 0:
+            return
+        with self._lock:
+            factor = 1 + self._random.uniform(-self.jitter, self.jitter)
+        time.sleep(self.seconds * factor)
+
+
+def _slug(text):
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")
+
+
+class FakeSerpAPI:
+    # Replaces web_search._fetch_serpapi_json. Links are made unique per query
+    # and page so source pools have as many distinct pages as a live search.
+    def __init__(self, latency, timer):
+        self.latency = latency
+        self.timer = timer
+        self.google = json.loads(_fixture("serpapi_google.json"))
+        self.youtube = json.loads(_fixture("serpapi_youtube.json"))
+
+    def __call__(self, params):
+        started = time.perf_counter()
+        self.latency.sleep()
+        query = _slug(params.get("q") or params.get("search_query") or "")
+        if params.get("engine") == "youtube":
+            page = int(str(params.get("sp") or "page-1").rsplit("-", 1)[-1])
+            data = json.loads(json.dumps(self.youtube))
+            for video in data["video_results"]:
+                video["link"] += f"-{query}-{page}"
+            data["serpapi_pagination"] = {"next_page_token": f"page-{page + 1}"} if page < 5 else {}
+        else:
+            start = int(params.get("start") or 0)
+            data = json.loads(json.dumps(self.google))
+            if start >= 100:
+                data["organic_results"] = []
+            for result in data["organic_results"]:
+                result["link"] += f"/{query}/{start + result['position']}"
+        self.timer.record("upstream_serpapi", time.perf_counter() - started)
+        return data
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+class FakeSession:
+    # Replaces the pooled requests.Session used for page downloads
+    def __init__(self, latency, timer):
+        self.latency = latency
+        self.timer = timer
+        self.article = _fixture("article.html")
+
+    def _variant(self, url):
+        # Text that differs per URL, so pages are not collapsed by the
+        # content-hash and near-duplicate caches the way real pages are not
+        words = re.findall(r"[a-z]+", self.article.lower())
+        rng = random.Random(url)
+        return " ".join(rng.choice(words) for _ in range(400))
+
+    def get(self, url, headers=None, timeout=None, **kwargs):
+        started = time.perf_counter()
+        self.latency.sleep()
+        etag = f'"{abs(hash(url)):x}"'
+        if headers and headers.get("If-None-Match") == etag:
+            response = FakeResponse(304, headers={"ETag": etag})
+        else:
+            title = url.rstrip("/").rsplit("/", 2)[-2].replace("-", " ").title()
+            html = (self.article.replace("{title}", title).replace("{url}", url)
+                    .replace("{variant}", self._variant(url)))
+            response = FakeResponse(200, html.encode("utf-8"), {"ETag": etag, "Content-Type": "text/html"})
+        self.timer.record("upstream_page", time.perf_counter() - started)
+        return response
+
+
+class FakeCompletions:
+    # Replaces client.chat.completions: plain, streamed and JSON (batched) answers
+    def __init__(self, latency, timer):
+        self.latency = latency
+        self.timer = timer
+        self.summary = _fixture("summary.txt").strip()
+
+    def _usage(self, prompt, answer):
+        return SimpleNamespace(prompt_tokens=len(prompt) // 4, completion_tokens=len(answer) // 4,
+                               total_tokens=(len(prompt) + len(answer)) // 4)
+
+    def create(self, model=None, messages=None, stream=False, response_format=None, **kwargs):
+        started = time.perf_counter()
+        prompt = "\n".join(m["content"] for m in messages or [])
+        self.latency.sleep()
+
+        if response_format and response_format.get("type") == "json_object":
+            sections = [{"title": title, "body": body.strip()}
+                        for title, body in re.findall(r"Section \d+: ([^\n]+)\n(.*?)(?=\nSection \d+:|\Z)", self.summary, re.S)]
+            units = [{"unit_number": int(n), "sections": sections}
+                     for n in re.findall(r"=== CONTENT FOR UNIT (\d+) ===", prompt)]
+            answer = json.dumps({"units": units})
+        elif "paraphrase" in prompt.lower():
+            answer = "Artificial intelligence ethics"
+        else:
+            answer = self.summary
+
+        self.timer.record("upstream_openai", time.perf_counter() - started)
+        if stream:
+            return self._stream(answer)
+        message = SimpleNamespace(content=answer)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=self._usage(prompt, answer))
+
+    @staticmethod
+    def _stream(answer):
+        for start in range(0, len(answer), 40):
+            delta = SimpleNamespace(content=answer[start:start + 40])
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+def install_stand_ins(args, timer):
+    import http_client
+    import web_search
+
+    web_search._fetch_serpapi_json = FakeSerpAPI(Latency(args.serp_latency, args.jitter, args.seed), timer)
+    http_client._session = FakeSession(Latency(args.page_latency, args.jitter, args.seed + 1), timer)
+    completions = FakeCompletions(Latency(args.llm_latency, args.jitter, args.seed + 2), timer)
+    http_client._openai_client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+
+def instrument_stages(timer):
+    import generator
+
+    timer.wrap(generator, "search_source_pool", "search")
+    timer.wrap(generator, "search_youtube_page", "search")
+    timer.wrap(generator, "extract_clean_text", "download_extract")
+    timer.wrap(generator, "summarize_to_learning_sections", "summarize")
+    timer.wrap(generator, "summarize_units_batch", "summarize")
+    timer.wrap(generator, "split_learning_sections", "split_sections")
+
+
+# -------------------------- Benchmarks --------------------------
+def bench_plan(args, timer, label):
+    from generator import generate_learning_units
+
+    timer.reset()
+    started = time.perf_counter()
+    units = generate_learning_units(args.topic, args.level, args.capacity, args.duration, medium=args.medium)
+    wall = time.perf_counter() - started
+    return {
+        "run": label,
+        "units": len(units),
+        "wall_s": wall,
+        "stages": timer.summary(),
+    }
+
+
+def bench_plan_memory(args, topic):
+    # tracemalloc slows every allocation down, so peak memory comes from
+    # separate runs instead of the timed ones. They use their own topic,
+    # which gets other fixture URLs, so the first run starts from cold caches.
+    from generator import generate_learning_units
+
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(2):
+            tracemalloc.reset_peak()
+            generate_learning_units(topic, args.level, args.capacity, args.duration, medium=args.medium)
+            peaks.append(tracemalloc.get_traced_memory()[1] / (1024 * 1024))
+    finally:
+        tracemalloc.stop()
+    return {"topic": topic, "cold_mb": peaks[0], "warm_mb": peaks[1]}
+
+
+def bench_functions(args):
+    from text_utils import split_into_sections
+    from web_search import extract_clean_text
+
+    text = " ".join([_fixture("summary.txt")] * 4)
+    rounds = args.iterations
+    started = time.perf_counter()
+    for _ in range(rounds):
+        split_into_sections(text, max_sections=4)
+    split_rate = rounds / (time.perf_counter() - started)
+
+    # A page already in the page cache: the cost every later plan pays
+    url = "https://fixtures.invalid/articles/introduction/bench/1"
+    extract_clean_text(url)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        extract_clean_text(url)
+    cached_rate = rounds / (time.perf_counter() - started)
+
+    return {"split_into_sections_per_s": split_rate, "extract_clean_text_cached_per_s": cached_rate}
+
+
+def bench_routes(args):
+    import learning_agent
+    from unit_provider import find_or_create_plan, get_provider
+
+    learning_agent.init_db()
+    plan_id = find_or_create_plan(learning_agent.plan_store, args.topic, args.level, args.capacity, args.duration,
+                                  medium=args.medium)
+    provider = get_provider(learning_agent.plan_store, plan_id)
+    provider.ensure_units(list(range(1, provider.unit_count + 1)))
+
+    client = learning_agent.app.test_client()
+    with client.session_transaction() as sess:
+        sess.update({
+            "paraphrased_topic": args.topic,
+            "knowledge_level": args.level,
+            "time_capacity": args.capacity,
+            "duration": args.duration,
+            "medium": args.medium,
+            "plan_id": plan_id,
+            "user_id": "benchmark",
+        })
+
+    routes = ["/", "/knowledge", "/learning/1", f"/api/plans/{plan_id}/units/1/sections?start=1&limit=2"]
+    results = {}
+    for route in routes:
+        status = client.get(route).status_code  # warm-up, also fills the page caches
+        started = time.perf_counter()
+        for _ in range(args.requests):
+            client.get(route)
+        elapsed = time.perf_counter() - started
+        results[route] = {"status": status, "requests_per_s": args.requests / elapsed,
+                          "mean_ms": elapsed / args.requests * 1000}
+    return results
+
+
+# -------------------------- Report --------------------------
+def print_report(report):
+    print(f"\nPlan: {report['config']['topic']!r} {report['config']['level']}/{report['config']['capacity']}/"
+          f"{report['config']['duration']} ({report['config']['medium']})")
+    for run in report["plans"]:
+        print(f"\n[{run['run']}] {run['units']} units in {run['wall_s']:.2f}s")
+        print(f"  {'stage':<20}{'count':>7}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for stage, s in run["stages"].items():
+            print(f"  {stage:<20}{s['count']:>7}{s['p50_ms']:>10.1f}{s['p90_ms']:>10.1f}"
+                  f"{s['p99_ms']:>10.1f}{s['max_ms']:>10.1f}")
+    if report.get("memory"):
+        memory = report["memory"]
+        print(f"\nPeak memory (separate traced runs on {memory['topic']!r})")
+        print(f"  cold caches {memory['cold_mb']:>8.1f} MB")
+        print(f"  warm caches {memory['warm_mb']:>8.1f} MB")
+    if report.get("functions"):
+        print("\nFunctions")
+        for name, rate in report["functions"].items():
+            print(f"  {name:<36}{rate:>12.0f}")
+    if report.get("routes"):
+        print("\nFlask routes (test client, one thread)")
+        for route, r in report["routes"].items():
+            print(f"  {route:<60} {r['status']}  {r['requests_per_s']:>8.0f} req/s  {r['mean_ms']:>6.2f} ms")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark for learning_agent")
+    parser.add_argument("--topic", default="AI ethics")
+    parser.add_argument("--level", default="basic")
+    parser.add_argument("--capacity", default="1-2 hours")
+    parser.add_argument("--duration", default="one-week")
+    parser.add_argument("--medium", default="text", choices=["text", "videos"])
+    parser.add_argument("--serp-latency", type=float, default=0.3, help="seconds per SerpAPI call")
+    parser.add_argument("--page-latency", type=float, default=0.2, help="seconds per page download")
+    parser.add_argument("--llm-latency", type=float, default=2.0, help="seconds per OpenAI call")
+    parser.add_argument("--jitter", type=float, default=0.2, help="random +/- fraction added to every latency")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--iterations", type=int, default=200, help="rounds for the function benchmarks")
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--skip-routes", action="store_true")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary cache directory")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    # Caches and the app database go to a scratch directory; the modules read
+    # these settings at import time, so they are set before anything is imported
+    workdir = tempfile.mkdtemp(prefix="learning_agent_bench_")
+    os.environ["SERP_CACHE_PATH"] = os.path.join(workdir, "serp_cache.db")
+    os.environ["PAGE_CACHE_PATH"] = os.path.join(workdir, "page_cache.db")
+    os.environ["ARTICLE_INDEX_PATH"] = os.path.join(workdir, "article_index.db")
+    os.environ["GPT_CACHE_DB"] = os.path.join(workdir, "gpt_cache.db")
+    os.environ["GPT_CACHE_BACKEND"] = "sqlite"
+    # Client-side rate limits would measure the limiter, not the pipeline
+    for provider in ("OPENAI", "SERPAPI"):
+        os.environ.setdefault(f"{provider}_RATE_LIMIT", "1000")
+        os.environ.setdefault(f"{provider}_BURST", "1000")
+    sys.path.insert(0, REPO_DIR)
+    os.chdir(workdir)
+
+    timer = StageTimer()
+    install_stand_ins(args, timer)
+    instrument_stages(timer)
+
+    report = {"config": vars(args), "plans": []}
+    try:
+        report["plans"].append(bench_plan(args, timer, "cold caches"))
+        report["plans"].append(bench_plan(args, timer, "warm caches"))
+        report["memory"] = bench_plan_memory(args, f"{args.topic} memory run")
+        report["functions"] = bench_functions(args)
+        if not args.skip_routes:
+            report["routes"] = bench_routes(args)
+    finally:
+        os.chdir(REPO_DIR)
+        if args.keep:
+            print(f"Benchmark data kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,278 @@
-import hashlib
-import os
-
-CACHE_DIR = os.path.join("mnt", "data", "gpt_cache")
-os.makedirs(CACHE_DIR, exist_ok=True)
-
-def generate_cache_key(topic, unit_number, text):
-    base = f"{topic}-{unit_number}-{text}"
-    return hashlib.sha256(base.encode()).hexdigest()
-
-def load_from_cache(key):
-    path = os.path.join(CACHE_DIR, f"{key}.txt")
-    if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            return f.read()
-    return None
-
-def save_to_cache(key, content):
-    path = os.path.join(CACHE_DIR, f"{key}.txt")
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(content)
\ No newline at end of file
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+from text_utils import hamming_distance
+from db import get_database
+from metrics import timed
+
+CACHE_DIR = os.path.join("mnt", "data", "gpt_cache")
+CACHE_DB = os.getenv("GPT_CACHE_DB", os.path.join("mnt", "data", "gpt_cache.db"))
+CACHE_BACKEND = os.getenv("GPT_CACHE_BACKEND", "sqlite")  # "sqlite" or "directory"
+CACHE_MAX_ENTRIES = int(os.getenv("GPT_CACHE_MAX_ENTRIES", "0"))  # 0 = unbounded
+CACHE_MAX_AGE = int(os.getenv("GPT_CACHE_MAX_AGE", "0"))  # seconds, 0 = never expires
+CACHE_COMPRESS = os.getenv("GPT_CACHE_COMPRESS", "1") == "1"
+
+# Eviction runs once every this many writes instead of on every save
+EVICT_EVERY = 100
+
+# Semantic keys: the 64-bit fingerprint is split into bands, and an entry is
+# reused when any band matches and the full fingerprints are close enough
+SEMANTIC_BANDS = 4
+SEMANTIC_MAX_DISTANCE = int(os.getenv("GPT_CACHE_MAX_DISTANCE", "3"))
+
+
+class _CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+            return getattr(self, name)
+
+    def as_dict(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "writes": self.writes, "evictions": self.evictions}
+
+
+class DirectoryCache:
+    # The original layout: one <key>.txt file per entry. Semantic band
+    # pointers are kept as <key>.ptr files and are not counted as entries.
+    def __init__(self, directory=CACHE_DIR, max_entries=CACHE_MAX_ENTRIES, max_age=CACHE_MAX_AGE):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.stats_counter = _CacheStats()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key, pointer=False):
+        return os.path.join(self.directory, f"{key}.ptr" if pointer else f"{key}.txt")
+
+    def load(self, key, pointer=False):
+        try:
+            with open(self._path(key, pointer), "r", encoding="utf-8") as f:
+                expired = self.max_age and time.time() - os.fstat(f.fileno()).st_mtime > self.max_age
+                content = None if expired else f.read()
+        except FileNotFoundError:
+            content = None
+        if not pointer:
+            self.stats_counter.count("hits" if content is not None else "misses")
+        return content
+
+    def save(self, key, content, pointer=False):
+        # Write to a temp file and rename it, so readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(tmp_path, self._path(key, pointer))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if not pointer and self.stats_counter.count("writes") % EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        if not self.max_entries and not self.max_age:
+            return 0
+        entries = {".txt": [], ".ptr": []}
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                suffix = entry.name[-4:]
+                if suffix in entries:
+                    entries[suffix].append((entry.stat().st_mtime, entry.path))
+
+        now = time.time()
+        doomed = set()
+        # Every entry has up to SEMANTIC_BANDS pointers to it
+        for suffix, limit in ((".txt", self.max_entries), (".ptr", self.max_entries * SEMANTIC_BANDS)):
+            files = sorted(entries[suffix])
+            expired = {path for mtime, path in files if self.max_age and now - mtime > self.max_age}
+            survivors = [path for mtime, path in files if path not in expired]
+            doomed |= expired
+            if limit and len(survivors) > limit:
+                doomed.update(survivors[:len(survivors) - limit])
+
+        for path in doomed:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        evicted = sum(1 for path in doomed if path.endswith(".txt"))
+        self.stats_counter.count("evictions", evicted)
+        return evicted
+
+    def stats(self):
+        with os.scandir(self.directory) as it:
+            entries = sum(1 for entry in it if entry.name.endswith(".txt"))
+        return dict(self.stats_counter.as_dict(), backend="directory", entries=entries)
+
+
+class SQLiteCache:
+    # All entries in a single SQLite file, so lookups are one indexed query
+    # and the cache can be bounded without walking a directory
+    def __init__(self, path=CACHE_DB, max_entries=CACHE_MAX_ENTRIES, max_age=CACHE_MAX_AGE, compress=CACHE_COMPRESS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.compress = compress
+        self.stats_counter = _CacheStats()
+        self.db = get_database(path)
+
+        with self.db.connect() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS gpt_cache (
+                key TEXT PRIMARY KEY,
+                value BLOB,
+                compressed INTEGER,
+                created_at REAL,
+                accessed_at REAL
+            )''')
+            # Semantic band pointers share the table but are bounded and counted separately
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(gpt_cache)')}
+            if "pointer" not in columns:
+                conn.execute('ALTER TABLE gpt_cache ADD COLUMN pointer INTEGER DEFAULT 0')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_gpt_cache_pointer ON gpt_cache(pointer, accessed_at)')
+
+    def load(self, key, pointer=False):
+        now = time.time()
+        with self.db.connect() as conn:
+            row = conn.execute('SELECT value, compressed, created_at FROM gpt_cache WHERE key = ?', (key,)).fetchone()
+            if row is not None and not (self.max_age and now - row[2] > self.max_age):
+                conn.execute('UPDATE gpt_cache SET accessed_at = ? WHERE key = ?', (now, key))
+
+        if row is None or (self.max_age and now - row[2] > self.max_age):
+            if not pointer:
+                self.stats_counter.count("misses")
+            return None
+        if not pointer:
+            self.stats_counter.count("hits")
+        value = zlib.decompress(row[0]) if row[1] else row[0]
+        return value.decode("utf-8")
+
+    def save(self, key, content, pointer=False):
+        now = time.time()
+        value = content.encode("utf-8")
+        compress = self.compress and not pointer
+        if compress:
+            value = zlib.compress(value)
+        with self.db.connect() as conn:
+            conn.execute('''INSERT OR REPLACE INTO gpt_cache (key, value, compressed, created_at, accessed_at, pointer)
+                            VALUES (?, ?, ?, ?, ?, ?)''', (key, value, int(compress), now, now, int(pointer)))
+        if not pointer and self.stats_counter.count("writes") % EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        if not self.max_entries and not self.max_age:
+            return 0
+        with self.db.connect() as conn:
+            evicted = 0
+            if self.max_age:
+                evicted += conn.execute('DELETE FROM gpt_cache WHERE pointer = 0 AND created_at < ?',
+                                        (time.time() - self.max_age,)).rowcount
+                conn.execute('DELETE FROM gpt_cache WHERE pointer = 1 AND created_at < ?', (time.time() - self.max_age,))
+            if self.max_entries:
+                # Every entry has up to SEMANTIC_BANDS pointers to it
+                for pointer, limit in ((0, self.max_entries), (1, self.max_entries * SEMANTIC_BANDS)):
+                    count = conn.execute('SELECT COUNT(*) FROM gpt_cache WHERE pointer = ?', (pointer,)).fetchone()[0]
+                    if count > limit:
+                        deleted = conn.execute('''DELETE FROM gpt_cache WHERE key IN (
+                            SELECT key FROM gpt_cache WHERE pointer = ? ORDER BY accessed_at LIMIT ?)''',
+                            (pointer, count - limit)).rowcount
+                        evicted += 0 if pointer else deleted
+        self.stats_counter.count("evictions", evicted)
+        return evicted
+
+    def stats(self):
+        # Read on every metrics scrape: the count walks the small pointer
+        # index, summing the stored values would read the whole table
+        with self.db.connect() as conn:
+            entries = conn.execute('SELECT COUNT(*) FROM gpt_cache WHERE pointer = 0').fetchone()[0]
+        return dict(self.stats_counter.as_dict(), backend="sqlite", entries=entries)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_cache_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = DirectoryCache() if CACHE_BACKEND == "directory" else SQLiteCache()
+        return _backend
+
+def set_cache_backend(backend):
+    # Any object with load(key, pointer=False), save(key, content, pointer=False),
+    # stats() and a _CacheStats stats_counter can be plugged in; pointer
+    # entries are not counted as hits, misses, writes or entries
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+def generate_cache_key(topic, unit_number, text):
+    base = f"{topic}-{unit_number}-{text}"
+    return hashlib.sha256(base.encode()).hexdigest()
+
+@timed("gpt_cache_load")
+def load_from_cache(key, pointer=False):
+    return get_cache_backend().load(key, pointer=pointer)
+
+@timed("gpt_cache_save")
+def save_to_cache(key, content, pointer=False):
+    get_cache_backend().save(key, content, pointer=pointer)
+
+def cache_stats():
+    return get_cache_backend().stats()
+
+def generate_semantic_cache_keys(fingerprint, **prompt_params):
+    # Fingerprints within SEMANTIC_MAX_DISTANCE bits share at least one band
+    params = json.dumps(prompt_params, sort_keys=True)
+    band_bits = 64 // SEMANTIC_BANDS
+    keys = []
+    for band in range(SEMANTIC_BANDS):
+        value = (fingerprint >> (band * band_bits)) & ((1 << band_bits) - 1)
+        keys.append(hashlib.sha256(f"{params}-{band}-{value:x}".encode()).hexdigest())
+    return keys
+
+def _semantic_content_key(keys):
+    # The band keys together encode the prompt parameters and the whole
+    # fingerprint, so they also name the one entry that holds the content
+    return hashlib.sha256("-".join(keys).encode()).hexdigest()
+
+def load_semantic_from_cache(keys, fingerprint, max_distance=SEMANTIC_MAX_DISTANCE):
+    # Pointers are read uncounted, so a lookup counts as one hit or miss:
+    # the read of the matched content, or the miss recorded at the end
+    backend = get_cache_backend()
+    for key in keys:
+        raw = load_from_cache(key, pointer=True)
+        if not raw:
+            continue
+        try:
+            entry = json.loads(raw)
+        except ValueError:
+            continue
+        if hamming_distance(int(entry["fingerprint"], 16), fingerprint) > max_distance:
+            continue
+        if "content" in entry:  # written before band keys became pointers
+            backend.stats_counter.count("hits")
+            return entry["content"]
+        # Counted by the backend; a pointer left behind by eviction counts as the miss
+        return load_from_cache(entry["key"])
+    backend.stats_counter.count("misses")
+    return None
+
+def save_semantic_to_cache(keys, fingerprint, content):
+    # The summary is stored once; each band key only points at it
+    content_key = _semantic_content_key(keys)
+    save_to_cache(content_key, content)
+    pointer = json.dumps({"fingerprint": f"{fingerprint:016x}", "key": content_key})
+    for key in keys:
+        save_to_cache(key, pointer, pointer=True)
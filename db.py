@@ -0,0 +1,72 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "30"))  # seconds a writer waits for the lock
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")  # NORMAL is durable enough under WAL
+DB_CACHED_STATEMENTS = int(os.getenv("DB_CACHED_STATEMENTS", "256"))
+
+
+class Database:
+    # One long-lived connection per thread and database file. Connections are
+    # opened in WAL mode, so readers never wait for the writer, and keep their
+    # prepared statements between calls.
+    def __init__(self, path, timeout=DB_BUSY_TIMEOUT, synchronous=DB_SYNCHRONOUS,
+                 cached_statements=DB_CACHED_STATEMENTS):
+        self.path = path
+        self.timeout = timeout
+        self.synchronous = synchronous
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, cached_statements=self.cached_statements)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    @contextmanager
+    def connect(self):
+        # Commits when the outermost block exits and rolls back if it raises,
+        # so a pooled connection is never handed on mid-transaction
+        conn = self.connection()
+        self._local.depth += 1
+        try:
+            yield conn
+        except BaseException:
+            self._local.depth -= 1
+            if self._local.depth == 0 and conn.in_transaction:
+                conn.rollback()
+            raise
+        self._local.depth -= 1
+        if self._local.depth == 0 and conn.in_transaction:
+            conn.commit()
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+def get_database(path):
+    # Everything that opens the same file shares the per-thread connections
+    key = os.path.abspath(path)
+    with _databases_lock:
+        if key not in _databases:
+            _databases[key] = Database(path)
+        return _databases[key]
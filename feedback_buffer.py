@@ -0,0 +1,115 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from db import get_database
+
+FEEDBACK_BATCH_SIZE = int(os.getenv("FEEDBACK_BATCH_SIZE", "100"))  # events that trigger an early flush
+FEEDBACK_FLUSH_INTERVAL = float(os.getenv("FEEDBACK_FLUSH_INTERVAL", "2.0"))  # seconds
+
+logger = logging.getLogger(__name__)
+
+
+class FeedbackBuffer:
+    # Write-behind buffer for feedback events. Requests only append to memory;
+    # a background thread writes everything collected so far in one
+    # transaction, whenever the buffer fills up or the interval passes, and
+    # once more when the process exits.
+    def __init__(self, database, batch_size=FEEDBACK_BATCH_SIZE, interval=FEEDBACK_FLUSH_INTERVAL):
+        self.database = database
+        self.db = get_database(database)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.flushed = 0
+        self.failures = 0
+        self._ratings = []
+        self._actions = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def init(self):
+        # Ratings keep using the feedback table created by init_db
+        with self.db.connect() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS feedback_actions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT,
+                plan_id TEXT,
+                unit_number INTEGER,
+                action TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_feedback_actions_plan ON feedback_actions(plan_id, unit_number)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_feedback_actions_created_at ON feedback_actions(created_at)')
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="feedback-writer", daemon=True)
+            self._thread.start()
+        atexit.register(self.flush)
+
+    @staticmethod
+    def _now():
+        # Same format and timezone as CURRENT_TIMESTAMP, taken when the event happened
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+
+    def add_rating(self, user_id, unit_number, rating, comment=""):
+        self._add(self._ratings, (user_id, unit_number, rating, comment, self._now()))
+
+    def add_action(self, user_id, plan_id, unit_number, action):
+        self._add(self._actions, (user_id, plan_id, unit_number, action, self._now()))
+
+    def _add(self, events, event):
+        with self._lock:
+            events.append(event)
+            full = len(self._ratings) + len(self._actions) >= self.batch_size
+        self.start()
+        if full:
+            self._wakeup.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._ratings) + len(self._actions)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                ratings, self._ratings = self._ratings, []
+                actions, self._actions = self._actions, []
+            if not ratings and not actions:
+                return 0
+            try:
+                with self.db.connect() as conn:
+                    conn.executemany('INSERT INTO feedback (user_id, unit_number, rating, comment, created_at) VALUES (?, ?, ?, ?, ?)',
+                                     ratings)
+                    conn.executemany('INSERT INTO feedback_actions (user_id, plan_id, unit_number, action, created_at) VALUES (?, ?, ?, ?, ?)',
+                                     actions)
+            except Exception as e:
+                # Put the batch back in front of anything that arrived meanwhile
+                logger.warning("Error writing feedback batch: %s", e)
+                with self._lock:
+                    self._ratings[:0] = ratings
+                    self._actions[:0] = actions
+                    self.failures += 1
+                return 0
+            with self._lock:
+                self.flushed += len(ratings) + len(actions)
+            return len(ratings) + len(actions)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(self._ratings) + len(self._actions),
+                "flushed": self.flushed,
+                "failures": self.failures,
+            }
@@ -1,154 +1,672 @@
-import os
-import openai
-from planner import calculate_units
-from learning_rules import LEARNING_LOGIC
-from web_search import search_web_snippets  
-from web_search import fetch_youtube_videos
-from text_utils import split_into_sections
-from openai import OpenAI
-from web_search import search_web_pages, extract_clean_text
-openai.api_key = os.getenv("OPENAI_API_KEY")
-from cache_utils import generate_cache_key, load_from_cache, save_to_cache
-
-#def generate_learning_units(topic, level, daily_capacity, duration):
-    #unit_count = calculate_units(level, daily_capacity, duration)
-    #all_snippets = search_web_snippets(topic, max_results=unit_count * 2)
-    
-    #units = []
-    #for i in range(unit_count):
-        #text = all_snippets[i] if i < len(all_snippets) else "No content available."
-        #sections = split_into_sections(text, max_sections=4)
-        #units.append({
-           # 'unit_number': i + 1,
-           # 'title': f"{topic} - Unit {i+1}",
-           # 'content': text,
-          #  'sections': sections  
-       # })
-    #return units
-def summarize_to_learning_sections(snippets, topic, unit_number, duration_minutes=120, feedback_action="great"):
-    estimated_time = "two hours" if duration_minutes >= 90 else "one hour"
-    
-    # Add nuance based on feedback
-    style_instruction = ""
-    if feedback_action == "harder":
-        style_instruction = "Go deeper into technical details, edge cases, or emerging challenges."
-    elif feedback_action == "easier":
-        style_instruction = "Use simpler explanations, analogies, and real-world examples to clarify complex points."
-
-    prompt = f"""
-You are an experienced academic tutor creating structured learning content for self-study.
-
-Your task is to turn the following article excerpts into a complete learning unit on "{topic}" that will take a learner approximately {"two hours" if duration_minutes >= 90 else "one hour"} to study.
-
-{style_instruction}
-
-Split the content into **5 progressive sections**, starting with an introduction and moving toward more advanced, detailed analysis. Each section should have a **clear subheading and at least 3–5 paragraphs**.
-    ...
-   
-
-Use accessible but intelligent language — the tone should resemble a university-level textbook chapter.
-
-=== CONTENT TO SUMMARIZE AND STRUCTURE ===
-{snippets}
-
-=== OUTPUT FORMAT ===
-Section 1: [Title]
-[3–5 paragraphs]
-
-Section 2: [Title]
-[3–5 paragraphs]
-
-... up to Section 5
-""".strip()
-
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": "You are a helpful academic assistant."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.7,
-    )
-
-    return response.choices[0].message.content.strip()
-
-
-
-def generate_learning_units(topic, level, daily_capacity, duration, medium="text", feedback_action="great"):
-    unit_count = calculate_units(level, daily_capacity, duration)
-    units = []
-
-    for i in range(unit_count):
-        if medium in ["video", "videos"]:
-            videos = fetch_youtube_videos(topic + f" part {i+1}", target_duration=3600, max_results=2)
-            
-            if not videos:
-                content = "<p><em>No high-quality videos were found for this topic. Try another search.</em></p>"
-                sections = [content]
-            else:
-                video_links = []
-                for v in videos:
-                    link = v.get("link", "")
-                    title = v.get("title", "Untitled Video")
-                    duration = v.get("duration", "Unknown")
-
-                    video_links.append(f"""
-                        <div class='video-entry'>
-                            <a href='{link}' target='_blank'>
-                                {v['title']} – {v['duration']}
-                            </a>
-                        </div>
-                    """)
-
-                content = "<h3>Take a close look at these videos:</h3>" + "".join(video_links)
-                sections = [content]  # ✅ important: wrap in sections for segment display
-
-
-        elif medium == "text":
-            urls = search_web_pages(topic, max_results=2)
-            articles = [extract_clean_text(url) for url in urls]
-            combined = "\n\n".join([a for a in articles if a and a.strip()])
-
-            if not combined.strip():
-                content = "No useful articles could be extracted."
-                sections = ["No content."]
-            else:
-                cache_key = generate_cache_key(f"{topic}-{medium}", i + 1, combined)
-                cached = load_from_cache(cache_key)
-
-                if cached:
-                    full_text = cached
-                else:
-                    feedback = feedback_action
-                    full_text = summarize_to_learning_sections(combined, topic, i + 1, duration_minutes=120, feedback_action=feedback)
-                    save_to_cache(cache_key, full_text)
-                parts = full_text.split("### ")
-                sections = [p.strip() for p in parts if p.strip()] 
-                content = ""  
-
-        units.append({
-            "unit_number": i + 1,
-            "title": f"{topic}",
-            "content": "",
-            "sections": sections
-        })
-
-    return units
-
-
-
-# test
-
-#if __name__ == "__main__":
- #   for unit in generate_learning_units("AI ethics", "basic", "1-2 hours", "one-week", medium="video"):
-  #      print(f"✔ Unit {unit['unit_number']}:")
-   #     print(unit["content"])
-
-
-    # test
-if __name__ == "__main__":
-    for unit in generate_learning_units("AI ethics", "basic", "1-2 hours", "one-week", medium="videos"):
-        print(f"✔ Unit {unit['unit_number']}:")
+import os
+import json
+import itertools
+import logging
+import math
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import openai
+from planner import calculate_units
+from learning_rules import LEARNING_LOGIC
+from web_search import search_web_snippets  
+from web_search import search_youtube_page, pack_videos
+from text_utils import split_into_sections, simhash, split_learning_sections, SectionStreamParser, reduce_sources, count_tokens
+from web_search import search_source_pool, extract_clean_text, normalize_url, ARTICLE_INDEX
+openai.api_key = os.getenv("OPENAI_API_KEY")
+SUMMARY_MODEL = "gpt-3.5-turbo"
+from rate_limiter import get_scheduler
+from http_client import get_openai_client
+from cache_utils import generate_semantic_cache_keys, load_semantic_from_cache, save_semantic_to_cache
+from metrics import span, timed, record_llm_usage, inc
+
+logger = logging.getLogger(__name__)
+
+#def generate_learning_units(topic, level, daily_capacity, duration):
+    #unit_count = calculate_units(level, daily_capacity, duration)
+    #all_snippets = search_web_snippets(topic, max_results=unit_count * 2)
+    
+    #units = []
+    #for i in range(unit_count):
+        #text = all_snippets[i] if i < len(all_snippets) else "No content available."
+        #sections = split_into_sections(text, max_sections=4)
+        #units.append({
+           # 'unit_number': i + 1,
+           # 'title': f"{topic} - Unit {i+1}",
+           # 'content': text,
+          #  'sections': sections  
+       # })
+    #return units
+def _wrap_instruction(wrap_round):
+    # Units past the end of the source pool reuse its pages; tell the model
+    # so it does not write the same unit again
+    if not wrap_round:
+        return ""
+    return (f"Earlier units of this course were already written from these sources (this is pass {wrap_round + 1}). "
+            "Do not repeat their introduction; cover aspects, examples and exercises they are likely to have left out.")
+
+
+def build_summary_prompt(snippets, topic, duration_minutes=120, feedback_action="great", wrap_round=0):
+    estimated_time = "two hours" if duration_minutes >= 90 else "one hour"
+    
+    # Add nuance based on feedback
+    style_instruction = ""
+    if feedback_action == "harder":
+        style_instruction = "Go deeper into technical details, edge cases, or emerging challenges."
+    elif feedback_action == "easier":
+        style_instruction = "Use simpler explanations, analogies, and real-world examples to clarify complex points."
+
+    prompt = f"""
+You are an experienced academic tutor creating structured learning content for self-study.
+
+Your task is to turn the following article excerpts into a complete learning unit on "{topic}" that will take a learner approximately {"two hours" if duration_minutes >= 90 else "one hour"} to study.
+
+{style_instruction}
+
+{_wrap_instruction(wrap_round)}
+
+Split the content into **5 progressive sections**, starting with an introduction and moving toward more advanced, detailed analysis. Each section should have a **clear subheading and at least 3–5 paragraphs**.
+    ...
+   
+
+Use accessible but intelligent language — the tone should resemble a university-level textbook chapter.
+
+=== CONTENT TO SUMMARIZE AND STRUCTURE ===
+{snippets}
+
+=== OUTPUT FORMAT ===
+Section 1: [Title]
+[3–5 paragraphs]
+
+Section 2: [Title]
+[3–5 paragraphs]
+
+... up to Section 5
+""".strip()
+
+    return prompt
+
+
+@timed("llm_summarize")
+def summarize_to_learning_sections(snippets, topic, unit_number, duration_minutes=120, feedback_action="great", wrap_round=0):
+    prompt = build_summary_prompt(snippets, topic, duration_minutes=duration_minutes, feedback_action=feedback_action,
+                                  wrap_round=wrap_round)
+
+    client = get_openai_client()
+
+    response = get_scheduler("openai").call(
+        client.chat.completions.create,
+        model=SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": "You are a helpful academic assistant."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.7,
+    )
+    record_llm_usage("summarize", SUMMARY_MODEL, getattr(response, "usage", None))
+
+    return response.choices[0].message.content.strip()
+
+
+def stream_summary_chunks(snippets, topic, unit_number, duration_minutes=120, feedback_action="great", wrap_round=0):
+    # Same request as summarize_to_learning_sections, yielded as the text arrives
+    prompt = build_summary_prompt(snippets, topic, duration_minutes=duration_minutes, feedback_action=feedback_action,
+                                  wrap_round=wrap_round)
+
+    client = get_openai_client()
+
+    stream = get_scheduler("openai").stream(
+        client.chat.completions.create,
+        model=SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": "You are a helpful academic assistant."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.7,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+
+    usage = None
+    with span("llm_stream"):
+        for chunk in stream:
+            # The last chunk carries the token usage and no choices
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    record_llm_usage("stream", SUMMARY_MODEL, usage)
+
+
+def build_batch_summary_prompt(items, topic, duration_minutes=120, feedback_action="great"):
+    style_instruction = ""
+    if feedback_action == "harder":
+        style_instruction = "Go deeper into technical details, edge cases, or emerging challenges."
+    elif feedback_action == "easier":
+        style_instruction = "Use simpler explanations, analogies, and real-world examples to clarify complex points."
+
+    units = "\n\n".join(
+        f"=== CONTENT FOR UNIT {unit_number} ===\n" + (f"{_wrap_instruction(wrap_round)}\n\n" if wrap_round else "") + snippets
+        for unit_number, snippets, wrap_round in items
+    )
+
+    prompt = f"""
+You are an experienced academic tutor creating structured learning content for self-study.
+
+Your task is to turn each of the following article collections into its own complete learning unit on "{topic}". Each unit will take a learner approximately {"two hours" if duration_minutes >= 90 else "one hour"} to study and must only use the content given for that unit.
+
+{style_instruction}
+
+Split every unit into **5 progressive sections**, starting with an introduction and moving toward more advanced, detailed analysis. Each section should have a **clear subheading and at least 3–5 paragraphs**.
+
+Use accessible but intelligent language — the tone should resemble a university-level textbook chapter.
+
+{units}
+
+=== OUTPUT FORMAT ===
+Answer with a single JSON object:
+{{"units": [{{"unit_number": <number>, "sections": [{{"title": "<subheading>", "body": "<paragraphs>"}}]}}]}}
+""".strip()
+
+    return prompt
+
+
+@timed("llm_summarize_batch")
+def summarize_units_batch(items, topic, duration_minutes=120, feedback_action="great"):
+    # One request for several units; returns {unit_number: text} in the same
+    # "Section k: Title" layout a single-unit summary uses
+    prompt = build_batch_summary_prompt(items, topic, duration_minutes=duration_minutes, feedback_action=feedback_action)
+
+    client = get_openai_client()
+
+    response = get_scheduler("openai").call(
+        client.chat.completions.create,
+        model=SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": "You are a helpful academic assistant."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.7,
+        response_format={"type": "json_object"},
+    )
+    record_llm_usage("summarize_batch", SUMMARY_MODEL, getattr(response, "usage", None))
+
+    try:
+        data = json.loads(response.choices[0].message.content)
+    except (TypeError, ValueError) as e:
+        logger.warning("Could not parse batched summary: %s", e)
+        return {}
+
+    units = data.get("units") if isinstance(data, dict) else None
+    if not isinstance(units, list):
+        logger.warning("Batched summary has no units list")
+        return {}
+
+    requested = {item[0] for item in items}
+    results = {}
+    for unit in units:
+        if not isinstance(unit, dict):
+            continue
+        try:
+            unit_number = int(unit.get("unit_number"))
+        except (TypeError, ValueError):
+            continue
+        sections = unit.get("sections")
+        if not isinstance(sections, list):
+            continue
+        sections = [sec for sec in sections if isinstance(sec, dict) and isinstance(sec.get("body"), str) and sec["body"]]
+        if unit_number in requested and sections:
+            results[unit_number] = "\n\n".join(
+                f"Section {k}: {str(sec.get('title') or '').strip()}\n{sec['body'].strip()}"
+                for k, sec in enumerate(sections, start=1)
+            )
+    return results
+
+
+
+# Per-stage concurrency limits for plan generation
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", "8"))
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", "4"))
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", "8"))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+# Units packed into one summarization request (1 = one request per unit)
+SUMMARY_BATCH_SIZE = int(os.getenv("SUMMARY_BATCH_SIZE", "1"))
+
+_search_slots = threading.BoundedSemaphore(SEARCH_CONCURRENCY)
+_download_slots = threading.BoundedSemaphore(DOWNLOAD_CONCURRENCY)
+_llm_slots = threading.BoundedSemaphore(LLM_CONCURRENCY)
+
+
+# Size of each unit's slice of the plan's source pool
+SOURCES_PER_UNIT = int(os.getenv("SOURCES_PER_UNIT", "2"))
+MAX_SOURCE_POOL = int(os.getenv("MAX_SOURCE_POOL", "100"))
+# Prompt tokens of source text per unit. Batched requests carry this much per
+# unit, so keep SOURCE_TOKEN_BUDGET * SUMMARY_BATCH_SIZE within the model context.
+SOURCE_TOKEN_BUDGET = int(os.getenv("SOURCE_TOKEN_BUDGET", "6000"))
+# Share of the pool the local article index must fill before SerpAPI is skipped
+INDEX_MIN_COVERAGE = float(os.getenv("INDEX_MIN_COVERAGE", "0.5"))
+
+
+def _download_article(url):
+    with _download_slots:
+        return extract_clean_text(url)
+
+
+def _merge_urls(urls, more):
+    merged = list(urls)
+    seen = {normalize_url(url) for url in urls}
+    for url in more:
+        key = normalize_url(url)
+        if key not in seen:
+            seen.add(key)
+            merged.append(url)
+    return merged
+
+
+def _pass_step(wrap_round, size):
+    # 1 for the first pass, then the next step coprime to size for each later one
+    step = 1
+    for _ in range(wrap_round):
+        step += 1
+        while math.gcd(step, size) != 1:
+            step += 1
+    return step
+
+
+class SourcePool:
+    # Per-plan retrieval stage: the topic is searched once for a deduplicated
+    # pool of pages, each unit reads its own slice and concurrent reads of
+    # a page share one download. Pages already in the local article
+    # index are picked first, and their text usually comes from the page cache.
+    def __init__(self, topic, unit_count, per_unit=SOURCES_PER_UNIT):
+        self.topic = topic
+        self.per_unit = per_unit
+        self.pool_size = max(per_unit, min(unit_count * per_unit, MAX_SOURCE_POOL))
+        self._urls = None
+        self._urls_lock = threading.Lock()
+        self._texts = {}  # url -> Future of a download in flight
+        self._texts_lock = threading.Lock()
+
+    def urls(self):
+        with self._urls_lock:
+            if self._urls is None:
+                self._urls = self._search()
+            return self._urls
+
+    def _search(self):
+        # A topic keeps the URL list its first plan was built from, so the
+        # slices, and with them the cached summaries, stay the same for
+        # later plans; it is only extended when a plan needs more pages
+        stored = ARTICLE_INDEX.saved_pool(self.topic)
+        if len(stored) >= self.pool_size:
+            inc("source_pool_total", source="stored")
+            return stored[:self.pool_size]
+
+        with span("article_index_search"):
+            local = ARTICLE_INDEX.search(self.topic, self.pool_size)
+        urls = _merge_urls(stored, local)
+        if len(urls) >= self.pool_size * INDEX_MIN_COVERAGE:
+            inc("source_pool_total", source="index")
+        else:
+            # Too thin: fill the rest of the pool from the web, known pages first
+            inc("source_pool_total", source="web")
+            with _search_slots:
+                urls = _merge_urls(urls, search_source_pool(self.topic, self.pool_size))
+        urls = urls[:self.pool_size]
+        if len(urls) > len(stored):
+            ARTICLE_INDEX.save_pool(self.topic, urls)
+        return urls
+
+    def wrap_round(self, unit_number):
+        # How many times the plan has gone through the whole pool before this unit
+        urls = self.urls()
+        return ((unit_number - 1) * self.per_unit) // len(urls) if urls else 0
+
+    def urls_for_unit(self, unit_number):
+        urls = self.urls()
+        if not urls:
+            return []
+        # Wrap around when the pool is smaller than the plan. Every pass walks
+        # the pool with a different step coprime to its size, so each page is
+        # still used once per pass but gets new partners.
+        offset = (unit_number - 1) * self.per_unit
+        step = _pass_step(offset // len(urls), len(urls))
+        start = offset % len(urls)
+        return [urls[((start + k) * step) % len(urls)] for k in range(min(self.per_unit, len(urls)))]
+
+    def text(self, url):
+        with self._texts_lock:
+            future = self._texts.get(url)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._texts[url] = future
+        if owner:
+            try:
+                # Through the page cache, so stale pages are revalidated
+                future.set_result(_download_article(url))
+            except Exception as e:
+                logger.warning("Error extracting %s: %s", url, e)
+                future.set_result("")
+            finally:
+                # Only in-flight downloads are shared; finished text lives in the page cache
+                with self._texts_lock:
+                    self._texts.pop(url, None)
+        return future.result()
+
+
+# Video plans: every unit is filled with up to VIDEO_UNIT_SECONDS of videos
+VIDEO_UNIT_SECONDS = int(os.getenv("VIDEO_UNIT_SECONDS", "3600"))
+# The first VIDEO_BASE_QUERIES variants are always searched, the rest only
+# when a large plan needs more candidates
+VIDEO_QUERY_SUFFIXES = ["", " tutorial", " lecture", " explained", " course", " introduction",
+                        " for beginners", " advanced", " full course", " lesson", " examples", " overview"]
+VIDEO_BASE_QUERIES = 4
+VIDEO_MAX_PAGES = int(os.getenv("VIDEO_MAX_PAGES", "3"))  # per query, for plans up to VIDEO_BASE_QUERIES * VIDEO_MAX_PAGES units
+VIDEO_POOL_SLACK = 1.5  # candidate time collected per second of plan time
+
+
+class VideoPlan:
+    # Per-plan retrieval stage for video plans: a few query variants are
+    # paged through concurrently, once per topic, and the candidates are
+    # bin-packed into units instead of searching once per unit.
+    def __init__(self, topic, unit_count, target_duration=VIDEO_UNIT_SECONDS):
+        self.topic = topic
+        self.unit_count = unit_count
+        self.target_duration = target_duration
+        self._units = None
+        self._lock = threading.Lock()
+
+    def _search(self, query, page_token):
+        try:
+            with _search_slots:
+                return search_youtube_page(query, page_token)
+        except Exception as e:
+            logger.warning("Error fetching YouTube videos for %r: %s", query, e)
+            return [], None
+
+    def candidates(self):
+        needed = self.unit_count * self.target_duration * VIDEO_POOL_SLACK
+        # Never more requests than searching once per unit would take, but
+        # at least the fixed budget small plans always had
+        budget = max(VIDEO_BASE_QUERIES * VIDEO_MAX_PAGES, self.unit_count)
+        max_pages = max(VIDEO_MAX_PAGES, math.ceil(budget / len(VIDEO_QUERY_SUFFIXES)))
+        suffixes = iter(VIDEO_QUERY_SUFFIXES)
+        results = {}  # query -> videos, in the order the queries were added
+        pending = {}  # query -> next page token
+        pages = {}
+        seen = set()
+        collected = 0
+        requests = 0
+
+        def add_queries(count):
+            for suffix in itertools.islice(suffixes, count):
+                query = self.topic + suffix
+                results[query] = []
+                pending[query] = None
+                pages[query] = 0
+
+        # Pages are fetched in rounds, all active queries at once, until the
+        # pool holds enough usable time, the budget is spent or the results
+        # run out. Once the base queries had VIDEO_MAX_PAGES rounds, every
+        # further round also brings in new query variants.
+        add_queries(VIDEO_BASE_QUERIES)
+        with ThreadPoolExecutor(max_workers=len(VIDEO_QUERY_SUFFIXES)) as pool:
+            rounds = 0
+            while collected < needed and requests < budget:
+                if rounds >= VIDEO_MAX_PAGES or not pending:
+                    add_queries(VIDEO_BASE_QUERIES)
+                if not pending:
+                    break
+                active = list(pending)[:budget - requests]
+                fetched = list(pool.map(self._search, active, [pending[query] for query in active]))
+                requests += len(active)
+                rounds += 1
+                for query, (videos, token) in zip(active, fetched):
+                    del pending[query]
+                    pages[query] += 1
+                    results[query].extend(videos)
+                    for video in videos:
+                        if video["link"] not in seen and 0 < video["seconds"] <= self.target_duration:
+                            seen.add(video["link"])
+                            collected += video["seconds"]
+                    if token and pages[query] < max_pages:
+                        pending[query] = token
+
+        # Interleave by rank so the best results of every query come first
+        merged = []
+        for rank in range(max((len(videos) for videos in results.values()), default=0)):
+            merged.extend(videos[rank] for videos in results.values() if rank < len(videos))
+        return merged
+
+    def units(self):
+        with self._lock:
+            if self._units is None:
+                units = pack_videos(self.candidates(), self.unit_count, self.target_duration)
+                self._fill_empty(units)
+                self._units = units
+            return self._units
+
+    def _fill_empty(self, units):
+        # Units the shared pool could not fill get their own search, as
+        # every unit did before plans were packed
+        empty = [n for n, unit in enumerate(units) if not unit]
+        if not empty:
+            return
+        logger.info("Searching separately for %d of %d video units", len(empty), len(units))
+        with ThreadPoolExecutor(max_workers=SEARCH_CONCURRENCY) as pool:
+            found = list(pool.map(lambda n: self._search(f"{self.topic} part {n + 1}", None)[0], empty))
+        used = {normalize_url(video["link"]) for unit in units for video in unit}
+        for n, videos in zip(empty, found):
+            unused = [video for video in videos if normalize_url(video["link"]) not in used]
+            units[n] = pack_videos(unused or videos, 1, self.target_duration)[0]
+            used.update(normalize_url(video["link"]) for video in units[n])
+
+    def videos_for_unit(self, unit_number):
+        units = self.units()
+        if not 0 < unit_number <= len(units):
+            return []
+        return units[unit_number - 1]
+
+
+def plan_sources(topic, unit_count, medium="text"):
+    if medium in ["video", "videos"]:
+        return VideoPlan(topic, unit_count)
+    return SourcePool(topic, unit_count)
+
+
+def _combined_sources(topic, unit_number, sources=None):
+    # Returns the unit's trimmed source text and its pass over the pool
+    if sources is None:
+        sources = SourcePool(topic, unit_number)
+    articles = [a for a in (sources.text(url) for url in sources.urls_for_unit(unit_number)) if a and a.strip()]
+    # Trimmed before the cache key is computed, so the key matches what the model sees
+    with span("reduce_sources"):
+        combined = reduce_sources(articles, topic, SOURCE_TOKEN_BUDGET)
+    inc("source_tokens_total", sum(count_tokens(a) for a in articles), stage="extracted")
+    inc("source_tokens_total", count_tokens(combined), stage="kept")
+    return combined, sources.wrap_round(unit_number)
+
+
+def _summary_cache_keys(combined, topic, medium, feedback_action, wrap_round=0):
+    # Keyed on a fingerprint of the normalized text plus everything that
+    # shapes the prompt, so near-identical sources reuse a summary
+    fingerprint = simhash(combined)
+    params = dict(topic=topic, medium=medium, feedback_action=feedback_action, duration_minutes=120, model=SUMMARY_MODEL)
+    if wrap_round:
+        # Left out on the first pass so existing entries keep their keys
+        params["wrap_round"] = wrap_round
+    cache_keys = generate_semantic_cache_keys(fingerprint, **params)
+    return fingerprint, cache_keys
+
+
+@timed("generate_unit")
+def generate_learning_unit(topic, unit_number, medium="text", feedback_action="great", sources=None):
+    i = unit_number - 1
+
+    if medium in ["video", "videos"]:
+        if sources is None:
+            sources = VideoPlan(topic, unit_number)
+        videos = sources.videos_for_unit(unit_number)
+
+        if not videos:
+            content = "<p><em>No high-quality videos were found for this topic. Try another search.</em></p>"
+            sections = [content]
+        else:
+            video_links = []
+            for v in videos:
+                link = v.get("link", "")
+                title = v.get("title", "Untitled Video")
+                duration = v.get("duration", "Unknown")
+
+                video_links.append(f"""
+                    <div class='video-entry'>
+                        <a href='{link}' target='_blank'>
+                            {v['title']} – {v['duration']}
+                        </a>
+                    </div>
+                """)
+
+            content = "<h3>Take a close look at these videos:</h3>" + "".join(video_links)
+            sections = [content]  # ✅ important: wrap in sections for segment display
+
+
+    elif medium == "text":
+        combined, wrap_round = _combined_sources(topic, unit_number, sources)
+
+        if not combined.strip():
+            content = "No useful articles could be extracted."
+            sections = ["No content."]
+        else:
+            fingerprint, cache_keys = _summary_cache_keys(combined, topic, medium, feedback_action, wrap_round)
+            cached = load_semantic_from_cache(cache_keys, fingerprint)
+
+            if cached:
+                full_text = cached
+            else:
+                feedback = feedback_action
+                with _llm_slots:
+                    full_text = summarize_to_learning_sections(combined, topic, i + 1, duration_minutes=120, feedback_action=feedback,
+                                                               wrap_round=wrap_round)
+                save_semantic_to_cache(cache_keys, fingerprint, full_text)
+            sections = split_learning_sections(full_text)
+            content = ""  
+
+    return {
+        "unit_number": i + 1,
+        "title": f"{topic}",
+        "content": "",
+        "sections": sections
+    }
+
+
+def stream_unit_sections(topic, unit_number, medium="text", feedback_action="great", sources=None):
+    # Yields the unit's sections one by one, as soon as each is complete
+    if medium != "text":
+        yield from generate_learning_unit(topic, unit_number, medium=medium, feedback_action=feedback_action,
+                                          sources=sources)["sections"]
+        return
+
+    combined, wrap_round = _combined_sources(topic, unit_number, sources)
+    if not combined.strip():
+        yield "No content."
+        return
+
+    fingerprint, cache_keys = _summary_cache_keys(combined, topic, medium, feedback_action, wrap_round)
+    cached = load_semantic_from_cache(cache_keys, fingerprint)
+    if cached:
+        yield from split_learning_sections(cached)
+        return
+
+    parser = SectionStreamParser()
+    chunks = []
+    with _llm_slots:
+        for chunk in stream_summary_chunks(combined, topic, unit_number, duration_minutes=120,
+                                           feedback_action=feedback_action, wrap_round=wrap_round):
+            chunks.append(chunk)
+            yield from parser.feed(chunk)
+    yield from parser.finish()
+    save_semantic_to_cache(cache_keys, fingerprint, "".join(chunks).strip())
+
+
+@timed("generate_unit_batch")
+def generate_learning_unit_batch(topic, unit_numbers, medium="text", feedback_action="great", sources=None):
+    if medium != "text" or SUMMARY_BATCH_SIZE <= 1 or len(unit_numbers) <= 1:
+        return [generate_learning_unit(topic, n, medium=medium, feedback_action=feedback_action, sources=sources)
+                for n in unit_numbers]
+
+    sections_by_unit = {}
+    pending = []
+    for n in unit_numbers:
+        combined, wrap_round = _combined_sources(topic, n, sources)
+        if not combined.strip():
+            sections_by_unit[n] = ["No content."]
+            continue
+        fingerprint, cache_keys = _summary_cache_keys(combined, topic, medium, feedback_action, wrap_round)
+        cached = load_semantic_from_cache(cache_keys, fingerprint)
+        if cached:
+            sections_by_unit[n] = split_learning_sections(cached)
+        else:
+            pending.append((n, combined, wrap_round, fingerprint, cache_keys))
+
+    # Cache misses share requests, SUMMARY_BATCH_SIZE units at a time
+    for start in range(0, len(pending), SUMMARY_BATCH_SIZE):
+        group = pending[start:start + SUMMARY_BATCH_SIZE]
+        try:
+            with _llm_slots:
+                texts = summarize_units_batch([(n, combined, wrap_round) for n, combined, wrap_round, _, _ in group], topic,
+                                              duration_minutes=120, feedback_action=feedback_action)
+        except Exception as e:
+            # e.g. the group's sources exceed the context window; every unit falls back below
+            logger.warning("Batched summary of units %s failed: %s", [item[0] for item in group], e)
+            texts = {}
+        for n, combined, wrap_round, fingerprint, cache_keys in group:
+            full_text = texts.get(n)
+            if not full_text:
+                # Missing from the batched answer: fall back to a single request
+                with _llm_slots:
+                    full_text = summarize_to_learning_sections(combined, topic, n, duration_minutes=120,
+                                                               feedback_action=feedback_action, wrap_round=wrap_round)
+            save_semantic_to_cache(cache_keys, fingerprint, full_text)
+            sections_by_unit[n] = split_learning_sections(full_text)
+
+    return [{
+        "unit_number": n,
+        "title": f"{topic}",
+        "content": "",
+        "sections": sections_by_unit[n]
+    } for n in unit_numbers]
+
+
+def generate_learning_units(topic, level, daily_capacity, duration, medium="text", feedback_action="great", max_workers=GENERATION_WORKERS):
+    unit_count = calculate_units(level, daily_capacity, duration)
+    workers = max(1, min(max_workers, unit_count))
+    sources = plan_sources(topic, unit_count, medium)
+
+    # Units (or batches of units) run concurrently while every stage stays
+    # within its own slot limit; pool.map hands the results back in order.
+    batch_size = max(1, SUMMARY_BATCH_SIZE) if medium == "text" else 1
+    numbers = list(range(1, unit_count + 1))
+    groups = [numbers[k:k + batch_size] for k in range(0, unit_count, batch_size)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        batches = pool.map(
+            lambda group: generate_learning_unit_batch(topic, group, medium=medium, feedback_action=feedback_action,
+                                                       sources=sources),
+            groups,
+        )
+        return [unit for batch in batches for unit in batch]
+
+
+
+# test
+
+#if __name__ == "__main__":
+ #   for unit in generate_learning_units("AI ethics", "basic", "1-2 hours", "one-week", medium="video"):
+  #      print(f"✔ Unit {unit['unit_number']}:")
+   #     print(unit["content"])
+
+
+    # test
+if __name__ == "__main__":
+    for unit in generate_learning_units("AI ethics", "basic", "1-2 hours", "one-week", medium="videos"):
+        print(f"✔ Unit {unit['unit_number']}:")
         print(unit["content"])
\ No newline at end of file
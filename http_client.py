@@ -0,0 +1,47 @@
+import os
+import threading
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from openai import OpenAI
+
+# Shared keep-alive connection pools for all outbound calls
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "32"))  # distinct hosts kept alive
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "16"))  # connections per host
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "16"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "120"))
+
+_session = None
+_openai_client = None
+_lock = threading.Lock()
+
+
+def get_http_session():
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            # Retries are handled by the rate_limiter schedulers, not by urllib3
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def get_openai_client():
+    global _openai_client
+    with _lock:
+        if _openai_client is None:
+            _openai_client = OpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                max_retries=0,  # retries are left to the scheduler
+                timeout=OPENAI_TIMEOUT,
+                http_client=httpx.Client(
+                    limits=httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS,
+                                        max_keepalive_connections=OPENAI_MAX_CONNECTIONS),
+                    timeout=OPENAI_TIMEOUT,
+                ),
+            )
+        return _openai_client
@@ -0,0 +1,106 @@
+import logging
+import os
+import threading
+from db import get_database
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2.0"))
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    # SQLite-backed queue of background jobs with a pool of worker threads.
+    # A handler receives the job row and a callback to report progress.
+    def __init__(self, database, handlers, workers=JOB_WORKERS):
+        self.database = database
+        self.db = get_database(database)
+        self.handlers = handlers
+        self.workers = workers
+        self._threads = []
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+
+    def init(self):
+        with self.db.connect() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT,
+                plan_id TEXT,
+                status TEXT,
+                progress INTEGER DEFAULT 0,
+                total INTEGER,
+                error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_plan_id ON jobs(plan_id)')
+            # Jobs that were running when the process died are picked up again
+            conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+        self.start()
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for n in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{n}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def enqueue(self, kind, plan_id, total=None):
+        # A plan already queued, running or done is not generated twice
+        with self.db.connect() as conn:
+            # BEGIN IMMEDIATE serializes the check and the insert, so concurrent
+            # requests for one plan share a single job
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute("SELECT id FROM jobs WHERE kind = ? AND plan_id = ? AND status != 'failed' ORDER BY id DESC LIMIT 1",
+                               (kind, plan_id)).fetchone()
+            if row is None:
+                job_id = conn.execute("INSERT INTO jobs (kind, plan_id, status, total) VALUES (?, ?, 'queued', ?)",
+                                      (kind, plan_id, total)).lastrowid
+            else:
+                job_id = row['id']
+        self.start()
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        with self.db.connect() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def latest_for_plan(self, plan_id):
+        with self.db.connect() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE plan_id = ? ORDER BY id DESC LIMIT 1', (plan_id,)).fetchone()
+        return dict(row) if row else None
+
+    def _set(self, job_id, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self.db.connect() as conn:
+            conn.execute(f'UPDATE jobs SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                         (*fields.values(), job_id))
+
+    def _claim(self):
+        with self.db.connect() as conn:
+            # BEGIN IMMEDIATE takes the write lock, so two workers never claim the same job
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET status = 'running', updated_at = CURRENT_TIMESTAMP WHERE id = ?", (row['id'],))
+            return dict(row) if row else None
+
+    def _work(self):
+        while True:
+            job = self._claim()
+            if job is None:
+                self._wakeup.wait(JOB_POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            try:
+                self.handlers[job['kind']](job, lambda progress: self._set(job['id'], progress=progress))
+                self._set(job['id'], status='done')
+            except Exception as e:
+                logger.exception("Job %s (%s) failed: %s", job['id'], job['kind'], e)
+                self._set(job['id'], status='failed', error=str(e))
@@ -1,60 +1,107 @@
 # AI Learning Agent Web App (Flask-based)
 
-from flask import Flask, render_template_string, request, session, redirect
-import sqlite3
+from flask import Flask, request, session, redirect, jsonify, Response, g
+import json
+import logging
+import time
+import threading
 import uuid
+from collections import OrderedDict
+from functools import lru_cache
+import hashlib
+from jinja2.utils import htmlsafe_json_dumps
 from datetime import datetime
-import openai
-from web_search import search_web_snippets
+from web_search import search_web_snippets, SERP_CACHE, PAGE_CACHE, ARTICLE_INDEX
 import os
-from generator import generate_learning_units
+from unit_provider import find_or_create_plan, get_provider, fork_plan
+from plan_store import PlanStore
+from cache_utils import cache_stats as gpt_cache_stats
+from rate_limiter import get_scheduler, scheduler_stats
+from http_client import get_openai_client
+from jobs import JobQueue
+from response_cache import ResponseCache
+from singleflight import SingleFlight
+from db import get_database
+from feedback_buffer import FeedbackBuffer
+from metrics import configure_logging, observe, record_llm_usage, register_stats, render_prometheus, timed
 
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key'
 
+configure_logging()
+logger = logging.getLogger(__name__)
+
 DATABASE = 'learning_agent.db'
+STREAM_SECTIONS = os.getenv('STREAM_SECTIONS', '1') == '1'
+JOB_CHUNK_SIZE = int(os.getenv('JOB_CHUNK_SIZE', '8'))
+UNIT_PAGE_CACHE_SIZE = int(os.getenv('UNIT_PAGE_CACHE_SIZE', '256'))
+SECTIONS_MAX_AGE = int(os.getenv('SECTIONS_MAX_AGE', '86400'))  # stored units never change
+SECTIONS_PAGE_LIMIT = 20
+db = get_database(DATABASE)
+plan_store = PlanStore(DATABASE)
+feedback_buffer = FeedbackBuffer(DATABASE)
 
 # -------------------------- DB Initialization --------------------------
 def init_db():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-        id TEXT PRIMARY KEY,
-        topic TEXT,
-        paraphrased_topic TEXT,
-        knowledge_level TEXT,
-        time_capacity TEXT,
-        duration TEXT,
-        medium TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )''')
-    cursor.execute('''CREATE TABLE IF NOT EXISTS feedback (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT,
-        unit_number INTEGER,
-        rating INTEGER,
-        comment TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )''')
-    conn.commit()
-    conn.close()
+    with db.connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            topic TEXT,
+            paraphrased_topic TEXT,
+            knowledge_level TEXT,
+            time_capacity TEXT,
+            duration TEXT,
+            medium TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS feedback (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            unit_number INTEGER,
+            rating INTEGER,
+            comment TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_feedback_user_unit ON feedback(user_id, unit_number)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_feedback_created_at ON feedback(created_at)')
+    plan_store.init()
+    job_queue.init()
+    feedback_buffer.init()
 
 # -------------------------- Paraphrasing with OpenAI --------------------------
+# Paraphrases of normalized topics, so resubmits and common topics skip the LLM
+paraphrase_cache = ResponseCache(DATABASE, table='paraphrase_cache',
+                                 ttl=int(os.getenv('PARAPHRASE_CACHE_TTL', str(30 * 86400))),
+                                 max_entries=int(os.getenv('PARAPHRASE_CACHE_MAX_ENTRIES', '5000')))
+_paraphrase_flight = SingleFlight()
+
 def paraphrase_topic(topic):
+    # Passed as the query field, which make_key collapses and lowercases
+    key = paraphrase_cache.make_key({'q': topic})
+    cached = paraphrase_cache.get(key)
+    if cached is not None:
+        return cached
+    # Concurrent submissions of the same topic wait on one LLM call
+    return _paraphrase_flight.do(key, lambda: _paraphrase_uncached(topic, key))
+
+def _paraphrase_uncached(topic, key):
     try:
-        openai.api_key = os.environ.get("OPENAI_API_KEY")  # Safer than hardcoding
-
-        response = openai.ChatCompletion.create(
+        response = get_scheduler("openai").call(
+            get_openai_client().chat.completions.create,
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": "You are an academic assistant."},
                 {"role": "user", "content": f"Paraphrase this topic in academic context: {topic}"}
             ]
         )
-        return response['choices'][0]['message']['content'].strip()
+        record_llm_usage("paraphrase", "gpt-3.5-turbo", getattr(response, "usage", None))
+        paraphrased = response.choices[0].message.content.strip()
+        paraphrase_cache.set(key, paraphrased)
+        return paraphrased
     except Exception as e:
-        print(f"Error in GPT call: {e}")
+        logger.warning("Error in GPT call: %s", e)
         return topic
 
 # -------------------------- Helper for learning units --------------------------
@@ -64,23 +111,69 @@ def search_google_scholar(query):
         {'title': f'Advanced {query} Topics', 'summary': f'Latest research in {query}.', 'url': f'https://scholar.google.com/scholar?q={query.replace(" ", "+")}'},
     ]
 
-def get_learning_units():
+def get_unit_provider():
     topic = session.get('paraphrased_topic', 'Artificial Intelligence')
     level = session.get('knowledge_level', 'basic')
     time_per_day = session.get('time_capacity', '1-2 hours')
     duration = session.get('duration', 'one-week')
     medium = session.get('medium', 'text')
 
-    # Rebuild only if medium has changed since last session
-    prev_medium = session.get('last_medium_used')
-    if 'learning_units' not in session or prev_medium != medium:
-        print("❗ Re-generating units due to new medium or no cache")
+    # Start a new plan if there is none yet or the learner changed its parameters
+    provider = get_provider(plan_store, session.get('plan_id'))
+    if provider is None or not provider.matches(topic, level, time_per_day, duration, medium):
+        logger.info("Starting a new plan due to changed parameters or no plan yet")
         feedback = session.get("feedback_action", "great")
-        units = generate_learning_units(topic, level, time_per_day, duration, medium=medium, feedback_action=feedback)
-        session['learning_units'] = units
-        session['last_medium_used'] = medium
+        # Units are kept server-side, the session only carries the plan id
+        plan_id = find_or_create_plan(plan_store, topic, level, time_per_day, duration, medium=medium, feedback_action=feedback)
+        provider = get_provider(plan_store, plan_id)
+        session['plan_id'] = plan_id
         session['feedback_action'] = "great"
-    return session['learning_units']
+    return provider
+
+# -------------------------- Background plan generation --------------------------
+def generate_plan(job, report_progress):
+    provider = get_provider(plan_store, job['plan_id'])
+    if provider is None:
+        raise ValueError(f"Unknown plan {job['plan_id']}")
+
+    # Unit 1 comes first so the learner can start as early as possible
+    provider.ensure_units([1])
+    report_progress(1)
+    for start in range(2, provider.unit_count + 1, JOB_CHUNK_SIZE):
+        chunk = list(range(start, min(start + JOB_CHUNK_SIZE, provider.unit_count + 1)))
+        provider.ensure_units(chunk)
+        report_progress(chunk[-1])
+
+job_queue = JobQueue(DATABASE, {'generate_plan': generate_plan})
+
+# -------------------------- Page rendering --------------------------
+@timed("render_page")
+def render_page(content):
+    # PAGE_TEMPLATE is compiled once at import, not per request
+    return PAGE_TEMPLATE.render(content=content)
+
+@lru_cache(maxsize=64)
+def render_static_page(content):
+    # Pages without per-learner values are rendered once per distinct content
+    return render_page(content)
+
+# Rendered pages of complete units, keyed by (plan_id, unit_number)
+_unit_pages = OrderedDict()
+_unit_pages_lock = threading.Lock()
+
+def cached_unit_page(plan_id, unit_number):
+    with _unit_pages_lock:
+        page = _unit_pages.get((plan_id, unit_number))
+        if page is not None:
+            _unit_pages.move_to_end((plan_id, unit_number))
+        return page
+
+def remember_unit_page(plan_id, unit_number, page):
+    with _unit_pages_lock:
+        _unit_pages[(plan_id, unit_number)] = page
+        _unit_pages.move_to_end((plan_id, unit_number))
+        while len(_unit_pages) > UNIT_PAGE_CACHE_SIZE:
+            _unit_pages.popitem(last=False)
 
 # -------------------------- Routes --------------------------
 @app.route('/', methods=['GET', 'POST'])
@@ -90,7 +183,7 @@ def index():
         session['topic'] = topic
         session['paraphrased_topic'] = paraphrase_topic(topic)
         return redirect('/confirm')
-    return render_template_string(TEMPLATE, content='''
+    return render_static_page('''
         <div class="message">
             <h2>Hello, let's bring you on a new level!</h2>
             <form method="POST">
@@ -104,7 +197,7 @@ def index():
 @app.route('/confirm', methods=['GET'])
 def confirm():
     topic = session.get('paraphrased_topic', 'the topic')
-    return render_template_string(TEMPLATE, content=f'''
+    return render_page(f'''
         <div class="message">
             <h2>Ok, let's learn something about: <em>{topic}</em></h2>
             <p>Is this correct?</p>
@@ -120,7 +213,7 @@ def knowledge():
     if request.method == 'POST':
         session['knowledge_level'] = request.form['level']
         return redirect('/capacity')
-    return render_template_string(TEMPLATE, content='''
+    return render_static_page('''
         <div class="message">
             <h2>Which level do you want to climb in this learning programme?</h2>
             <form method="POST" style="text-align: center;">
@@ -137,7 +230,7 @@ def capacity():
     if request.method == 'POST':
         session['time_capacity'] = request.form['capacity']
         return redirect('/duration')
-    return render_template_string(TEMPLATE, content='''
+    return render_static_page('''
         <div class="message">
             <h2>How much time can you dedicate to learning each day?</h2>
             <form method="POST">
@@ -164,7 +257,7 @@ def duration():
     else:
         opts = ['one-week', 'one-month', 'three-months']
     buttons = ''.join([f'<button class="btn" name="duration" value="{o}">{o.replace("-", " ").title()}</button><br><br>' for o in opts])
-    return render_template_string(TEMPLATE, content=f'''
+    return render_static_page(f'''
         <div class="message">
             <h2>How long should this learning project last?</h2>
             <form method="POST">{buttons}</form>
@@ -177,7 +270,7 @@ def medium():
     if request.method == 'POST':
         session['medium'] = request.form['medium']
         return redirect('/confirm-plan')
-    return render_template_string(TEMPLATE, content='''
+    return render_static_page('''
         <div class="message">
             <h2>Which medium do you prefer to learn with?</h2>
             <form method="POST">
@@ -195,7 +288,14 @@ def confirm_plan():
     time = session.get('time_capacity')
     duration = session.get('duration')
     medium = session.get('medium')
-    return render_template_string(TEMPLATE, content=f'''
+
+    # The first units start right away on the prefetch pool, so the learner
+    # does not wait behind other plans' jobs; the rest of the plan runs on
+    # the job workers and this page only polls its progress
+    provider = get_unit_provider()
+    provider.prefetch(0)
+    job_queue.enqueue('generate_plan', provider.plan_id, total=provider.unit_count)
+    return render_page(f'''
         <div class="message">
             <h2>Let's start learning!</h2>
             <p><strong>Topic:</strong> {topic}</p>
@@ -203,53 +303,164 @@ def confirm_plan():
             <p><strong>Time:</strong> {time}</p>
             <p><strong>Duration:</strong> {duration}</p>
             <p><strong>Medium:</strong> {medium}</p>
-            <a class="btn btn-primary" href="/learning/1">Start Learning</a>
+            <p id="plan-progress"><em>Preparing your first learning unit…</em></p>
+            <a id="start-learning" class="btn btn-primary" href="/learning/1" style="display: none;">Start Learning</a>
         </div>
         <br><a href="/medium" class="btn btn-secondary">Go Back</a>
+
+        <script>
+            function pollProgress() {{
+                fetch("/plan-progress")
+                    .then(response => response.json())
+                    .then(progress => {{
+                        const label = document.getElementById("plan-progress");
+                        if (progress.first_unit_ready) {{
+                            document.getElementById("start-learning").style.display = "inline-block";
+                            label.innerHTML = `<em>${{progress.ready_units}} of ${{progress.unit_count}} learning units ready</em>`;
+                        }} else if (progress.status === "failed") {{
+                            // Units are still generated on demand when the background job fails
+                            document.getElementById("start-learning").style.display = "inline-block";
+                            label.innerHTML = "<em>Your units will be prepared as you go.</em>";
+                            return;
+                        }}
+                        if (progress.ready_units < progress.unit_count) {{
+                            setTimeout(pollProgress, 2000);
+                        }}
+                    }})
+                    .catch(() => setTimeout(pollProgress, 5000));
+            }}
+            pollProgress();
+        </script>
     ''')
 
+@app.route('/plan-progress')
+def plan_progress():
+    provider = get_provider(plan_store, session.get('plan_id'))
+    if provider is None:
+        return jsonify({'status': 'missing'}), 404
+    job = job_queue.latest_for_plan(provider.plan_id)
+    return jsonify({
+        'plan_id': provider.plan_id,
+        'status': job['status'] if job else 'idle',
+        'ready_units': plan_store.count_units(provider.plan_id),
+        'unit_count': provider.unit_count,
+        'first_unit_ready': plan_store.has_unit(provider.plan_id, 1),
+    })
+
 @app.route('/feedback', methods=['POST'])
 def feedback():
     user_id = session.get('user_id', str(uuid.uuid4()))
     unit_number = int(request.form['unit_number'])
     rating = int(request.form['rating'])
     comment = request.form.get('comment', '')
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('''INSERT INTO feedback (user_id, unit_number, rating, comment) VALUES (?, ?, ?, ?)''',
-                   (user_id, unit_number, rating, comment))
-    conn.commit()
-    conn.close()
+    # Written to the feedback table in batches by the background writer
+    feedback_buffer.add_rating(user_id, unit_number, rating, comment)
     return redirect(f'/learning/{unit_number}')
 
 @app.route('/feedback-action', methods=['POST'])
 def feedback_action():
     session['feedback_action'] = request.form.get('feedback_action', 'great')
     unit_number = int(request.form.get('unit_number', 1))
+    feedback_buffer.add_action(session.get('user_id'), session.get('plan_id'), unit_number, session['feedback_action'])
     
     if session['feedback_action'] == 'refine':
         return redirect('/')
+    if session['feedback_action'] in ('harder', 'easier'):
+        # Units up to this one stay, the upcoming ones are generated again at the new difficulty
+        provider = get_provider(plan_store, session.get('plan_id'))
+        if provider is not None:
+            session['plan_id'] = fork_plan(plan_store, provider, session['feedback_action'], unit_number)
+            get_provider(plan_store, session['plan_id']).prefetch(unit_number)
     return redirect(f'/learning/{unit_number + 1}')
 
+@app.route('/learning/<int:unit_number>/stream')
+def learning_stream(unit_number):
+    provider = get_provider(plan_store, session.get('plan_id'))
+    if provider is None or unit_number < 1 or unit_number > provider.unit_count:
+        return Response(status=404)
+
+    # EventSource reconnects send the id of the last section they received
+    try:
+        first = int(request.headers.get('Last-Event-ID', -1)) + 1
+    except ValueError:
+        first = 0
+
+    def events():
+        try:
+            for index, section in enumerate(provider.stream_unit(unit_number)):
+                if index >= first:
+                    yield f"id: {index}\ndata: {json.dumps(section)}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            logger.warning("Error streaming unit %s: %s", unit_number, e)
+            yield "event: failed\ndata: {}\n\n"
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/plans/<plan_id>/units/<int:unit_number>/sections')
+def unit_sections(plan_id, unit_number):
+    # Sections of a stored unit, `limit` at a time from `start`. The URL
+    # names the plan, so the responses can be cached by browsers and proxies.
+    provider = get_provider(plan_store, plan_id)
+    if provider is None or unit_number < 1 or unit_number > provider.unit_count:
+        return jsonify({'error': 'not found'}), 404
+    unit = plan_store.load_unit(plan_id, unit_number)
+    if unit is None:
+        response = jsonify({'status': 'pending'})
+        response.status_code = 202
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    start = max(0, request.args.get('start', 0, type=int))
+    limit = min(max(1, request.args.get('limit', 1, type=int)), SECTIONS_PAGE_LIMIT)
+    body = json.dumps({
+        'plan_id': plan_id,
+        'unit_number': unit_number,
+        'start': start,
+        'total': len(unit['sections']),
+        'sections': unit['sections'][start:start + limit],
+    })
+    response = Response(body, mimetype='application/json')
+    response.set_etag(hashlib.sha256(body.encode()).hexdigest()[:32])
+    response.cache_control.public = True
+    response.cache_control.max_age = SECTIONS_MAX_AGE
+    return response.make_conditional(request)
+
 @app.route('/learning/<int:unit_number>')
 def learning(unit_number):
     session.setdefault('user_id', str(uuid.uuid4()))
-    units = get_learning_units()
+    provider = get_unit_provider()
 
-    if unit_number < 1 or unit_number > len(units):
+    if unit_number < 1 or unit_number > provider.unit_count:
         return redirect('/learning/1')
 
-    unit = units[unit_number - 1]
+    # Only this unit is generated now, the next ones are prefetched.
+    # A text unit that is not ready yet is streamed into the page section by section.
+    # Only complete units are cached, so a cached page needs no store lookup
+    page = cached_unit_page(provider.plan_id, unit_number)
+    if page is not None:
+        provider.prefetch(unit_number)
+        return page
+
+    stream = False
+    unit = provider.peek_unit(unit_number)
+    if unit is not None:
+        provider.prefetch(unit_number)
+    elif STREAM_SECTIONS and provider.medium == 'text':
+        stream = True
+        unit = {'unit_number': unit_number, 'title': provider.topic, 'content': '', 'sections': []}
+    else:
+        unit = provider.get_unit(unit_number)
 
-    # ✅ DEBUG: Confirm medium and content
-    print(f"Rendering medium: {session.get('medium')}")
-    print(f"Unit content preview: {unit['content'][:100]}")
+    logger.debug("Rendering medium: %s", session.get('medium'))
+    logger.debug("Unit content preview: %s", unit['content'][:100])
 
     # Navigation buttons
     buttons = '<div class="button-row" style="display: flex; justify-content: center; gap: 10px;">'
     if unit_number > 1:
         buttons += f'<a class="btn" href="/learning/{unit_number - 1}">Previous Learning Unit</a>'
-    if unit_number < len(units):
+    if unit_number < provider.unit_count:
         buttons += f'<a class="btn" href="/learning/{unit_number + 1}">Next Learning Unit</a>'
     buttons += '</div>'
 
@@ -260,7 +471,7 @@ def learning(unit_number):
     is_video = medium in ["video", "videos"]
 
     # fallback if no sections available
-    if 'sections' not in unit or not unit['sections']:
+    if not stream and ('sections' not in unit or not unit['sections']):
         unit['sections'] = [unit.get("content", "No content available.")]
 
     # Unified rendering with segment navigation + feedback at the end of text unit
@@ -287,35 +498,79 @@ def learning(unit_number):
         </form>
 
         <script>
-                const sections = {unit['sections']};
+                // Only the first section is inlined; the others are fetched from the sections API
+                const sectionsUrl = {htmlsafe_json_dumps(f"/api/plans/{provider.plan_id}/units/{unit_number}/sections")};
+                const sections = {htmlsafe_json_dumps(unit['sections'][:1])};
+                let total = {len(unit['sections'])};
                 let index = 0;
+                let streamDone = {'false' if stream else 'true'};
 
                 function updateSection() {{
-                    document.getElementById("section-text").innerHTML = sections[index];
+                    document.getElementById("section-text").innerHTML =
+                        sections[index] !== undefined ? sections[index] : "<p><em>Preparing this learning unit…</em></p>";
 
                     // Show feedback only at last section if medium is "text"
-                    if ("{medium}" === "text" && index === sections.length - 1) {{
+                    if ("{medium}" === "text" && streamDone && index === total - 1) {{
                         document.getElementById("feedback-form").style.display = "block";
                     }} else {{
                         document.getElementById("feedback-form").style.display = "none";
                     }}
                 }}
 
-                function nextSection() {{
-                    if (index < sections.length - 1) {{
-                        index++;
+                function loadSection(i) {{
+                    if (sections[i] !== undefined || !streamDone || i >= total) {{
+                        return Promise.resolve();
+                    }}
+                    return fetch(`${{sectionsUrl}}?start=${{i}}&limit=1`)
+                        .then(response => response.json())
+                        .then(page => {{
+                            page.sections.forEach((section, k) => {{ sections[page.start + k] = section; }});
+                            total = page.total;
+                        }});
+                }}
+
+                function showSection(i) {{
+                    loadSection(i).then(() => {{
+                        index = i;
                         updateSection();
+                        loadSection(i + 1); // warm the next one before it is clicked
+                    }});
+                }}
+
+                function nextSection() {{
+                    if (index < total - 1) {{
+                        showSection(index + 1);
                     }}
                 }}
 
                 function prevSection() {{
                     if (index > 0) {{
-                        index--;
-                        updateSection();
+                        showSection(index - 1);
                     }}
                 }}
 
+                if (!streamDone) {{
+                    // Sections arrive over server-sent events while the unit is generated
+                    const source = new EventSource("/learning/{unit_number}/stream");
+                    source.onmessage = (event) => {{
+                        sections.push(JSON.parse(event.data));
+                        total = sections.length;
+                        updateSection();
+                    }};
+                    source.addEventListener("done", () => {{
+                        streamDone = true;
+                        source.close();
+                        updateSection();
+                    }});
+                    source.addEventListener("failed", () => {{
+                        source.close();
+                        document.getElementById("section-text").innerHTML =
+                            "<p><em>This learning unit could not be generated. Please reload the page.</em></p>";
+                    }});
+                }}
+
                 updateSection(); // Initial call
+                loadSection(1);
             </script>
         </div>
         """
@@ -373,10 +628,44 @@ def learning(unit_number):
     </script>
     '''
     if session.get("medium") in ["video", "videos"]:
-        print("⚠️ DEBUG VIDEO HTML BLOCK:")
-        print(unit["content"])  # Print actual HTML string that will be rendered
+        logger.debug("Video unit HTML: %s", unit["content"])
     # Safe render
-    return render_template_string(TEMPLATE, content=content)
+    page = render_page(content)
+    if not stream:
+        # A streamed page is only a shell for the sections still to come
+        remember_unit_page(provider.plan_id, unit_number, page)
+    return page
+
+def _cache_stats():
+    return {'serpapi': SERP_CACHE.stats(), 'pages': PAGE_CACHE.stats(), 'gpt': gpt_cache_stats(),
+            'paraphrase': paraphrase_cache.stats(), 'articles': ARTICLE_INDEX.stats()}
+
+@app.route('/cache-stats')
+def cache_stats():
+    return jsonify(dict(_cache_stats(), schedulers=scheduler_stats(), feedback=feedback_buffer.stats()))
+
+# -------------------------- Metrics --------------------------
+register_stats('cache', 'cache', _cache_stats)
+register_stats('scheduler', 'provider', scheduler_stats)
+register_stats('feedback_buffer', 'buffer', lambda: {'feedback': feedback_buffer.stats()})
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    # Labeled by route pattern, not by path, so unit numbers and plan ids do not multiply series
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        observe('http_request_seconds', time.perf_counter() - started,
+                route=route, method=request.method, status=response.status_code)
+    return response
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
 
 
 # -------------------------- Template --------------------------
@@ -433,6 +722,7 @@ TEMPLATE = '''
 </body>
 </html>
 '''
+PAGE_TEMPLATE = app.jinja_env.from_string(TEMPLATE)
 
 if __name__ == '__main__':
     init_db()
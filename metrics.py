@@ -0,0 +1,185 @@
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))  # share of DEBUG/INFO records kept
+METRICS_PREFIX = "learning_agent"
+SPAN_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Stats keys that only ever grow are exported as counters, everything else as gauges
+COUNTER_STATS = {"hits", "misses", "writes", "evictions", "revalidated", "calls", "retries", "failures", "flushed"}
+
+METRIC_HELP = {
+    "stage_seconds": "Duration of instrumented pipeline stages",
+    "stage_errors_total": "Instrumented stages that raised",
+    "http_request_seconds": "Duration of Flask requests by route",
+    "llm_requests_total": "Chat completion requests",
+    "llm_tokens_total": "Tokens reported by the OpenAI API",
+}
+
+logger = logging.getLogger(__name__)
+
+_counters = {}  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts, sum, count]
+_collectors = []  # (family, label, fn returning {instance: stats dict})
+_lock = threading.Lock()
+
+
+def _labels(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        entry = _histograms.get(key)
+        if entry is None:
+            entry = _histograms[key] = [[0] * len(SPAN_BUCKETS), 0.0, 0]
+        for i, bound in enumerate(SPAN_BUCKETS):
+            if value <= bound:
+                entry[0][i] += 1
+        entry[1] += value
+        entry[2] += 1
+
+
+@contextmanager
+def span(stage, **labels):
+    # Times the block into stage_seconds and counts it in stage_errors_total if it raises
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except GeneratorExit:
+        # A consumer that stops reading a generator early is not an error
+        raise
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        observe("stage_seconds", elapsed, stage=stage, **labels)
+        if failed:
+            inc("stage_errors_total", stage=stage, **labels)
+        logger.debug("%s took %.1f ms%s", stage, elapsed * 1000, " (failed)" if failed else "")
+
+
+def timed(stage):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_llm_usage(call, model, usage):
+    inc("llm_requests_total", call=call, model=model)
+    if usage is None:
+        return
+    inc("llm_tokens_total", getattr(usage, "prompt_tokens", 0) or 0, call=call, model=model, kind="prompt")
+    inc("llm_tokens_total", getattr(usage, "completion_tokens", 0) or 0, call=call, model=model, kind="completion")
+
+
+def register_stats(family, label, fn):
+    # fn() returns {instance: {stat: number}}, e.g. the cache and scheduler stats
+    # dicts; they are read at scrape time instead of being mirrored here
+    _collectors.append((family, label, fn))
+
+
+# -------------------------- Prometheus text format --------------------------
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus():
+    families = {}  # metric name -> (type, [(labels, value)])
+
+    def add(name, kind, labels, value):
+        families.setdefault(name, (kind, []))[1].append((labels, value))
+
+    with _lock:
+        for (name, labels), value in _counters.items():
+            add(name, "counter", labels, value)
+        histograms = [(name, labels, list(entry[0]), entry[1], entry[2]) for (name, labels), entry in _histograms.items()]
+
+    for family, label, fn in _collectors:
+        try:
+            instances = fn()
+        except Exception as e:
+            logger.warning("Metrics collector %s failed: %s", family, e)
+            continue
+        for instance, stats in instances.items():
+            for stat, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                counter = stat in COUNTER_STATS
+                add(f"{family}_{stat}{'_total' if counter else ''}", "counter" if counter else "gauge",
+                    ((label, str(instance)),), value)
+
+    lines = []
+    for name in sorted(families):
+        kind, samples = families[name]
+        full_name = f"{METRICS_PREFIX}_{name}"
+        lines.append(f"# HELP {full_name} {METRIC_HELP.get(name, name.replace('_', ' '))}")
+        lines.append(f"# TYPE {full_name} {kind}")
+        for labels, value in sorted(samples):
+            lines.append(f"{full_name}{_format_labels(labels)} {_format_value(value)}")
+
+    for name in sorted({h[0] for h in histograms}):
+        full_name = f"{METRICS_PREFIX}_{name}"
+        lines.append(f"# HELP {full_name} {METRIC_HELP.get(name, name.replace('_', ' '))}")
+        lines.append(f"# TYPE {full_name} histogram")
+        for hist_name, labels, buckets, total, count in sorted(histograms):
+            if hist_name != name:
+                continue
+            for bound, bucket_count in zip(SPAN_BUCKETS, buckets):
+                lines.append(f"{full_name}_bucket{_format_labels(labels + (('le', repr(bound)),))} {bucket_count}")
+            lines.append(f"{full_name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{full_name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{full_name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+# -------------------------- Logging --------------------------
+class SamplingFilter(logging.Filter):
+    # Keeps every warning and error but only a share of the debug and info records
+    def __init__(self, rate=LOG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+def configure_logging(level=LOG_LEVEL, sample_rate=LOG_SAMPLE_RATE):
+    root = logging.getLogger()
+    if any(getattr(handler, "_learning_agent", False) for handler in root.handlers):
+        return
+    handler = logging.StreamHandler()
+    handler._learning_agent = True
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    handler.addFilter(SamplingFilter(sample_rate))
+    root.addHandler(handler)
+    root.setLevel(level)
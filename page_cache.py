@@ -0,0 +1,121 @@
+import threading
+import time
+from db import get_database
+
+
+class PageCache:
+    # Keeps the raw HTML and the extracted text of downloaded pages, keyed by URL.
+    # Stale entries are revalidated with ETag/Last-Modified, and the total
+    # stored size is kept under max_bytes by evicting least recently used pages.
+    def __init__(self, path, max_age=7 * 86400, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.db = get_database(path)
+
+        with self.db.connect() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                html BLOB,
+                text TEXT,
+                content_hash TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                size INTEGER,
+                fetched_at REAL,
+                accessed_at REAL
+            )''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_pages_content_hash ON pages(content_hash)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_pages_accessed_at ON pages(accessed_at)')
+            # Running entry and byte totals, so eviction and stats do not scan the table
+            conn.execute('''CREATE TABLE IF NOT EXISTS page_totals (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                entries INTEGER,
+                bytes INTEGER
+            )''')
+            conn.execute('''INSERT OR IGNORE INTO page_totals (id, entries, bytes)
+                            SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM pages''')
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get(self, url):
+        now = time.time()
+        with self.db.connect() as conn:
+            row = conn.execute('SELECT text, etag, last_modified, fetched_at FROM pages WHERE url = ?', (url,)).fetchone()
+            if row is not None:
+                conn.execute('UPDATE pages SET accessed_at = ? WHERE url = ?', (now, url))
+        if row is None:
+            self._count("misses")
+            return None
+
+        fresh = now - row[3] < self.max_age
+        if fresh:
+            self._count("hits")
+        return {"text": row[0], "etag": row[1], "last_modified": row[2], "fresh": fresh}
+
+    def mark_fresh(self, url):
+        # The origin answered 304, so the stored copy is good for another max_age
+        now = time.time()
+        with self.db.connect() as conn:
+            conn.execute('UPDATE pages SET fetched_at = ?, accessed_at = ? WHERE url = ?', (now, now, url))
+        self._count("revalidated")
+
+    def text_for_hash(self, content_hash):
+        # Identical HTML (served under another URL or re-downloaded unchanged)
+        # reuses the earlier extraction instead of parsing again
+        with self.db.connect() as conn:
+            row = conn.execute('SELECT text FROM pages WHERE content_hash = ? LIMIT 1', (content_hash,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, url, html, text, content_hash, etag=None, last_modified=None):
+        now = time.time()
+        size = len(html) + len((text or "").encode("utf-8"))
+        with self.db.connect() as conn:
+            # Taken as a writer up front, so the size read below cannot go stale
+            conn.execute('BEGIN IMMEDIATE')
+            old = conn.execute('SELECT size FROM pages WHERE url = ?', (url,)).fetchone()
+            conn.execute('''INSERT OR REPLACE INTO pages
+                            (url, html, text, content_hash, etag, last_modified, size, fetched_at, accessed_at)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                         (url, html, text, content_hash, etag, last_modified, size, now, now))
+            conn.execute('UPDATE page_totals SET entries = entries + ?, bytes = bytes + ? WHERE id = 0',
+                         (0 if old else 1, size - (old[0] if old else 0)))
+            evicted = self._evict(conn)
+        with self._lock:
+            self.evictions += evicted
+
+    def _evict(self, conn):
+        total = conn.execute('SELECT bytes FROM page_totals WHERE id = 0').fetchone()[0]
+        evicted = 0
+        freed = 0
+        while total > self.max_bytes:
+            row = conn.execute('SELECT url, size FROM pages ORDER BY accessed_at LIMIT 1').fetchone()
+            if row is None:
+                break
+            conn.execute('DELETE FROM pages WHERE url = ?', (row[0],))
+            total -= row[1]
+            freed += row[1]
+            evicted += 1
+        if evicted:
+            conn.execute('UPDATE page_totals SET entries = entries - ?, bytes = bytes - ? WHERE id = 0', (evicted, freed))
+        return evicted
+
+    def stats(self):
+        with self.db.connect() as conn:
+            count, total = conn.execute('SELECT entries, bytes FROM page_totals WHERE id = 0').fetchone()
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidated": self.revalidated,
+                "evictions": self.evictions,
+                "entries": count,
+                "bytes": total,
+            }
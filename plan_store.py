@@ -0,0 +1,125 @@
+import json
+import uuid
+from db import get_database
+
+
+class PlanStore:
+    # Server-side storage for plans and their generated units
+    def __init__(self, database):
+        self.database = database
+        self.db = get_database(database)
+
+    def init(self):
+        with self.db.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''CREATE TABLE IF NOT EXISTS plans (
+                id TEXT PRIMARY KEY,
+                topic TEXT,
+                knowledge_level TEXT,
+                time_capacity TEXT,
+                duration TEXT,
+                medium TEXT,
+                feedback_action TEXT,
+                unit_count INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )''')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS plan_units (
+                plan_id TEXT,
+                unit_number INTEGER,
+                title TEXT,
+                content TEXT,
+                sections TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (plan_id, unit_number)
+            )''')
+            # Learners with identical plan parameters share one plan
+            cursor.execute('''CREATE TABLE IF NOT EXISTS plan_keys (
+                plan_key TEXT PRIMARY KEY,
+                plan_id TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )''')
+            # Plans regenerated from a unit onwards after difficulty feedback
+            cursor.execute('''CREATE TABLE IF NOT EXISTS plan_forks (
+                plan_id TEXT PRIMARY KEY,
+                parent_id TEXT,
+                from_unit INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_plan_forks_parent ON plan_forks(parent_id)')
+
+    def get_or_create_plan(self, plan_key, topic, knowledge_level, time_capacity, duration, medium, feedback_action,
+                           unit_count, max_age):
+        with self.db.connect() as conn:
+            # BEGIN IMMEDIATE serializes concurrent lookups, also across processes
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute("SELECT plan_id FROM plan_keys WHERE plan_key = ? AND created_at > datetime('now', ?)",
+                               (plan_key, f'-{int(max_age)} seconds')).fetchone()
+            if row is not None:
+                return row[0]
+
+            plan_id = str(uuid.uuid4())
+            conn.execute('''INSERT INTO plans (id, topic, knowledge_level, time_capacity, duration, medium, feedback_action, unit_count)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                         (plan_id, topic, knowledge_level, time_capacity, duration, medium, feedback_action, unit_count))
+            conn.execute('INSERT OR REPLACE INTO plan_keys (plan_key, plan_id) VALUES (?, ?)', (plan_key, plan_id))
+            return plan_id
+
+    def fork_plan(self, fork_key, parent_id, feedback_action, keep_through, max_age):
+        # Copy of the parent plan at a new difficulty that keeps units up to
+        # keep_through; the remaining units are generated again on access
+        with self.db.connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute("SELECT plan_id FROM plan_keys WHERE plan_key = ? AND created_at > datetime('now', ?)",
+                               (fork_key, f'-{int(max_age)} seconds')).fetchone()
+            if row is not None:
+                return row[0]
+
+            plan_id = str(uuid.uuid4())
+            conn.execute('''INSERT INTO plans (id, topic, knowledge_level, time_capacity, duration, medium, feedback_action, unit_count)
+                            SELECT ?, topic, knowledge_level, time_capacity, duration, medium, ?, unit_count
+                            FROM plans WHERE id = ?''', (plan_id, feedback_action, parent_id))
+            conn.execute('''INSERT INTO plan_units (plan_id, unit_number, title, content, sections, created_at)
+                            SELECT ?, unit_number, title, content, sections, created_at
+                            FROM plan_units WHERE plan_id = ? AND unit_number <= ?''', (plan_id, parent_id, keep_through))
+            conn.execute('INSERT INTO plan_forks (plan_id, parent_id, from_unit) VALUES (?, ?, ?)',
+                         (plan_id, parent_id, keep_through + 1))
+            conn.execute('INSERT OR REPLACE INTO plan_keys (plan_key, plan_id) VALUES (?, ?)', (fork_key, plan_id))
+            return plan_id
+
+    def get_plan(self, plan_id):
+        with self.db.connect() as conn:
+            row = conn.execute('''SELECT plans.*, plan_forks.parent_id, plan_forks.from_unit FROM plans
+                                  LEFT JOIN plan_forks ON plan_forks.plan_id = plans.id
+                                  WHERE plans.id = ?''', (plan_id,)).fetchone()
+        return dict(row) if row else None
+
+    def save_unit(self, plan_id, unit):
+        with self.db.connect() as conn:
+            conn.execute('''INSERT OR REPLACE INTO plan_units (plan_id, unit_number, title, content, sections)
+                            VALUES (?, ?, ?, ?, ?)''',
+                         (plan_id, unit['unit_number'], unit['title'], unit.get('content', ''),
+                          json.dumps(unit['sections'])))
+
+    def load_unit(self, plan_id, unit_number):
+        with self.db.connect() as conn:
+            row = conn.execute('SELECT title, content, sections FROM plan_units WHERE plan_id = ? AND unit_number = ?',
+                               (plan_id, unit_number)).fetchone()
+        if row is None:
+            return None
+        return {
+            "unit_number": unit_number,
+            "title": row[0],
+            "content": row[1],
+            "sections": json.loads(row[2]),
+        }
+
+    def count_units(self, plan_id):
+        with self.db.connect() as conn:
+            count = conn.execute('SELECT COUNT(*) FROM plan_units WHERE plan_id = ?', (plan_id,)).fetchone()[0]
+        return count
+
+    def has_unit(self, plan_id, unit_number):
+        with self.db.connect() as conn:
+            row = conn.execute('SELECT 1 FROM plan_units WHERE plan_id = ? AND unit_number = ?',
+                               (plan_id, unit_number)).fetchone()
+        return row is not None
@@ -0,0 +1,233 @@
+import logging
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+# Status codes and exception types worth retrying; everything else fails fast
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = {
+    "APIConnectionError", "APITimeoutError", "RateLimitError", "InternalServerError",
+    "ConnectionError", "Timeout", "ConnectTimeout", "ReadTimeout", "TimeoutError",
+}
+
+
+class TokenBucket:
+    # Allows `rate` calls per second on average with bursts of up to `capacity`
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        # A Retry-After from the provider holds back every caller, not just the one that got it
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class AdaptiveLimiter:
+    # AIMD concurrency limit: grows by one after a window of fast successes,
+    # shrinks on slow responses and halves on throttling or errors
+    def __init__(self, maximum, minimum=1, target_latency=10.0):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.target_latency = target_latency
+        self.limit = maximum
+        self._active = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self._active >= self.limit:
+                self._condition.wait()
+            self._active += 1
+
+    def release(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+    def on_success(self, latency):
+        with self._condition:
+            if latency > 2 * self.target_latency:
+                self.limit = max(self.minimum, self.limit - 1)
+                self._successes = 0
+            elif latency <= self.target_latency:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self._successes = 0
+                    self._condition.notify()
+
+    def on_failure(self):
+        with self._condition:
+            self.limit = max(self.minimum, self.limit // 2)
+            self._successes = 0
+
+
+def _status_code(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def is_retryable(error):
+    if _status_code(error) in RETRYABLE_STATUS:
+        return True
+    return any(cls.__name__ in RETRYABLE_ERRORS for cls in type(error).__mro__)
+
+
+def retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class ProviderScheduler:
+    # Client-side scheduler for one upstream provider: token bucket rate
+    # limiting, adaptive concurrency and retries with exponential backoff
+    def __init__(self, name, rate, burst, max_concurrency, target_latency=10.0,
+                 max_retries=5, base_delay=1.0, max_delay=60.0):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.limiter = AdaptiveLimiter(max_concurrency, target_latency=target_latency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _start(self, fn, *args, **kwargs):
+        # Runs fn with retries and returns its result and start time, still
+        # holding the concurrency slot
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            self.limiter.acquire()
+            self._count("calls")
+            started = time.monotonic()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                self.limiter.release()
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                self.limiter.on_failure()
+                delay = retry_after(e)
+                if delay is not None:
+                    self.bucket.pause(delay)
+                else:
+                    # Full jitter keeps retrying workers from moving in lockstep
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                logger.info("%s: retrying in %.1fs after %s: %s", self.name, delay, type(e).__name__, e)
+                self._count("retries")
+                attempt += 1
+                time.sleep(delay)
+                continue
+            return result, started
+
+    def call(self, fn, *args, **kwargs):
+        result, started = self._start(fn, *args, **kwargs)
+        self.limiter.release()
+        self.limiter.on_success(time.monotonic() - started)
+        return result
+
+    def stream(self, fn, *args, **kwargs):
+        # For streamed responses: yields the items of fn's result and keeps the
+        # slot until the stream is consumed, closed or fails, so the limit
+        # covers the whole generation and not just the request
+        stream, started = self._start(fn, *args, **kwargs)
+        try:
+            yield from stream
+        except Exception as e:
+            self._count("failures")
+            if is_retryable(e):
+                self.limiter.on_failure()
+            raise
+        finally:
+            close = getattr(stream, "close", None)
+            if close:
+                close()
+            self.limiter.release()
+        self.limiter.on_success(time.monotonic() - started)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "failures": self.failures,
+                "concurrency_limit": self.limiter.limit,
+            }
+
+
+# -------------------------- Shared schedulers --------------------------
+SCHEDULER_DEFAULTS = {
+    "openai": {"rate": 3.0, "burst": 10, "max_concurrency": int(os.getenv("LLM_CONCURRENCY", "4")), "target_latency": 30.0},
+    "serpapi": {"rate": 5.0, "burst": 10, "max_concurrency": int(os.getenv("SEARCH_CONCURRENCY", "4")), "target_latency": 5.0},
+}
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def get_scheduler(name):
+    with _schedulers_lock:
+        if name not in _schedulers:
+            defaults = SCHEDULER_DEFAULTS.get(name, {"rate": 5.0, "burst": 10, "max_concurrency": 4, "target_latency": 10.0})
+            prefix = name.upper()
+            _schedulers[name] = ProviderScheduler(
+                name,
+                rate=float(os.getenv(f"{prefix}_RATE_LIMIT", defaults["rate"])),
+                burst=int(os.getenv(f"{prefix}_BURST", defaults["burst"])),
+                max_concurrency=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", defaults["max_concurrency"])),
+                target_latency=defaults["target_latency"],
+                max_retries=int(os.getenv(f"{prefix}_MAX_RETRIES", "5")),
+            )
+        return _schedulers[name]
+
+def scheduler_stats():
+    with _schedulers_lock:
+        return {name: scheduler.stats() for name, scheduler in _schedulers.items()}
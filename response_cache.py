@@ -0,0 +1,108 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from db import get_database
+
+# Free-text query parameters; everything else (page tokens, filters) is case-sensitive
+QUERY_PARAMS = {"q", "search_query"}
+
+
+class ResponseCache:
+    # Read-through TTL cache for JSON responses. Entries are persisted in SQLite
+    # and the most recent ones are also kept in memory, so repeat lookups skip
+    # the disk entirely.
+    def __init__(self, path, table="responses", ttl=86400, max_entries=10000, memory_entries=512):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.db = get_database(path)
+
+        with self.db.connect() as conn:
+            conn.execute(f'''CREATE TABLE IF NOT EXISTS {table} (
+                key TEXT PRIMARY KEY,
+                value TEXT,
+                expires_at REAL,
+                accessed_at REAL
+            )''')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_accessed_at ON {table}(accessed_at)')
+
+    @staticmethod
+    def make_key(params):
+        # Case and whitespace differences in the query must not create new entries
+        normalized = {}
+        for name, value in params.items():
+            if name == "api_key" or value is None:
+                continue
+            if name in QUERY_PARAMS and isinstance(value, str):
+                value = " ".join(value.split()).lower()
+            normalized[name] = value
+        return json.dumps(normalized, sort_keys=True)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[0] > now:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        with self.db.connect() as conn:
+            row = conn.execute(f'SELECT value, expires_at FROM {self.table} WHERE key = ?', (key,)).fetchone()
+            if row is not None and row[1] > now:
+                conn.execute(f'UPDATE {self.table} SET accessed_at = ? WHERE key = ?', (now, key))
+
+        if row is None or row[1] <= now:
+            with self._lock:
+                self._memory.pop(key, None)
+                self.misses += 1
+            return None
+
+        value = json.loads(row[0])
+        with self._lock:
+            self._remember(key, row[1], value)
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        now = time.time()
+        expires_at = now + self.ttl
+        with self.db.connect() as conn:
+            conn.execute(f'INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+                         (key, json.dumps(value), expires_at, now))
+            evicted = self._evict(conn, now)
+        with self._lock:
+            self._remember(key, expires_at, value)
+            self.evictions += evicted
+
+    def _remember(self, key, expires_at, value):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, conn, now):
+        # Expired entries go first, then the least recently used ones over the limit
+        evicted = conn.execute(f'DELETE FROM {self.table} WHERE expires_at <= ?', (now,)).rowcount
+        count = conn.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+        if count > self.max_entries:
+            evicted += conn.execute(f'''DELETE FROM {self.table} WHERE key IN (
+                SELECT key FROM {self.table} ORDER BY accessed_at LIMIT ?)''', (count - self.max_entries,)).rowcount
+        return evicted
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+            }
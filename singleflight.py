@@ -0,0 +1,28 @@
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    # Concurrent calls with the same key share one execution of fn:
+    # the first caller runs it, everyone else waits for its result
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._calls[key] = future
+
+        if owner:
+            try:
+                future.set_result(fn())
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+        return future.result()
@@ -0,0 +1,14 @@
+from response_cache import ResponseCache
+
+
+def test_query_is_normalized():
+    assert ResponseCache.make_key({'q': 'AI Ethics'}) == ResponseCache.make_key({'q': '  ai   ethics '})
+    assert ResponseCache.make_key({'search_query': 'AI Ethics'}) == ResponseCache.make_key({'search_query': 'ai ethics'})
+
+
+def test_other_params_keep_their_case():
+    assert ResponseCache.make_key({'q': 'ai', 'sp': 'CAoQAA'}) != ResponseCache.make_key({'q': 'ai', 'sp': 'caoqaa'})
+
+
+def test_api_key_and_missing_values_are_ignored():
+    assert ResponseCache.make_key({'q': 'ai', 'api_key': 'secret', 'start': None}) == ResponseCache.make_key({'q': 'ai'})
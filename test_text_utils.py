@@ -0,0 +1,57 @@
+from text_utils import reduce_sources
+
+FILLER = "This sentence adds enough ordinary words to push the sources over a small budget. " * 6
+
+
+def test_sources_under_budget_are_unchanged():
+    texts = ["Principles\nFairness\nAccountability", "Read more about ethics."]
+    assert reduce_sources(texts, "ethics", 10000) == "Principles\nFairness\nAccountability\n\nRead more about ethics."
+
+
+def test_short_lines_are_kept_with_the_following_paragraph():
+    text = "\n".join([
+        "Intro line of the page that is long enough to count as a paragraph here.",
+        "The core principles are:",
+        "Fairness",
+        "Accountability",
+        "Transparency",
+        "Privacy",
+        "Each principle shapes how automated decisions should be designed and reviewed.",
+        FILLER,
+        FILLER,
+    ])
+    reduced = reduce_sources([text], "principles", 200)
+    assert "Fairness\nAccountability\nTransparency\nPrivacy" in reduced
+
+
+def test_boilerplate_phrases_only_drop_chrome():
+    article = "\n".join([
+        "Subscribe to our newsletter",
+        "Ethics of data collection is a broad field with many open questions today.",
+        "Most of those questions are about who sees which data and for what purpose.",
+        "Tracking cookies let advertisers follow users across sites without clear consent.",
+        FILLER,
+        "More filler that keeps this article going for a few more words at least.",
+        "Another filler line that keeps the page edge away from the cookie paragraph.",
+        "Yet another line near the end of the page with plenty of ordinary words.",
+        "All rights reserved",
+    ])
+    reduced = reduce_sources([article], "cookies consent", 150)
+    assert "Tracking cookies" in reduced
+    assert "Subscribe" not in reduced
+    assert "All rights reserved" not in reduced
+
+
+def test_boilerplate_repeated_across_sources_is_dropped():
+    middle = "Log in to read the full story and more from our site."
+    pages = ["\n".join([
+        f"Opening paragraph number {n} about the topic with enough words in it to count.",
+        "Second paragraph for padding with enough words in it to count as one too.",
+        "Third paragraph for padding with enough words in it to count as one too.",
+        middle,
+        FILLER,
+        "Closing paragraph one with enough words in it to count as one too here.",
+        "Closing paragraph two with enough words in it to count as one too here.",
+        "Closing paragraph three with enough words in it to count as one too here.",
+    ]) for n in range(2)]
+    assert "Log in" not in reduce_sources(pages, "topic", 300)
@@ -1,8 +1,193 @@
-import re
-
-def split_into_sections(snippet: str, max_sections: int = 4):
-    sentences = re.split(r'(?<=[.!?]) +', snippet.strip())
-    if not sentences:
-        return [snippet]
-    avg = max(1, len(sentences) // max_sections)
-    return [" ".join(sentences[i:i+avg]) for i in range(0, len(sentences), avg)][:max_sections]
\ No newline at end of file
+import hashlib
+import math
+import re
+from collections import Counter
+
+try:
+    import tiktoken
+except ImportError:  # optional: token counts fall back to an estimate
+    tiktoken = None
+
+def split_into_sections(snippet: str, max_sections: int = 4):
+    sentences = re.split(r'(?<=[.!?]) +', snippet.strip())
+    if not sentences:
+        return [snippet]
+    avg = max(1, len(sentences) // max_sections)
+    return [" ".join(sentences[i:i+avg]) for i in range(0, len(sentences), avg)][:max_sections]
+
+def normalize_text(text: str):
+    # Drops case, digits (dates, counters, timestamps) and punctuation so that
+    # cosmetic page changes do not change the fingerprint
+    text = re.sub(r'\d+', ' ', text.lower())
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return " ".join(text.split())
+
+
+def simhash(text: str, shingle_size: int = 3):
+    # 64-bit SimHash over word shingles; near-identical texts differ in few bits
+    words = normalize_text(text).split()
+    if not words:
+        return 0
+    shingles = Counter(" ".join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1)))
+    weights = [0] * 64
+    for shingle, count in shingles.items():
+        h = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += count if (h >> bit) & 1 else -count
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+def hamming_distance(a: int, b: int):
+    return bin(a ^ b).count("1")
+
+
+# A new learning section starts at a "### " heading or a "Section k:" line
+SECTION_BOUNDARY = re.compile(r'^(?:###\s|Section\s+\d+\s*:)', re.IGNORECASE | re.MULTILINE)
+
+
+class SectionStreamParser:
+    # Splits a completion into sections while it is still streaming in:
+    # a section is complete as soon as the next heading shows up
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, chunk: str):
+        self._buffer += chunk
+        starts = [m.start() for m in SECTION_BOUNDARY.finditer(self._buffer) if m.start() > 0]
+        sections = []
+        previous = 0
+        for start in starts:
+            sections.append(self._buffer[previous:start])
+            previous = start
+        self._buffer = self._buffer[previous:]
+        return [s for s in (_clean_section(s) for s in sections) if s]
+
+    def finish(self):
+        section = _clean_section(self._buffer)
+        self._buffer = ""
+        return [section] if section else []
+
+
+def _clean_section(text: str):
+    return re.sub(r'^###\s', '', text.strip()).strip()
+
+
+def split_learning_sections(text: str):
+    parser = SectionStreamParser()
+    return parser.feed(text) + parser.finish()
+
+
+# -------------------------- Source reduction --------------------------
+_encoding = None
+
+def count_tokens(text: str):
+    # Exact with tiktoken installed, otherwise about four characters per token
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+BOILERPLATE = re.compile(
+    r"cookie|all rights reserved|privacy policy|terms of (use|service)|sign up|subscribe|newsletter|"
+    r"advertisement|share this|related articles|click here|enable javascript|log in|read more",
+    re.IGNORECASE,
+)
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in", "is", "it", "of", "on",
+    "or", "that", "the", "this", "to", "was", "what", "when", "where", "which", "who", "why", "with",
+}
+MIN_PARAGRAPH_WORDS = 8
+# Lines this close to the top or bottom of a page are where site chrome lives
+EDGE_LINES = 3
+
+
+def content_terms(text: str):
+    return [w for w in normalize_text(text).split() if w not in STOPWORDS]
+
+
+def _is_chrome(line: str, position: int, line_count: int, repeated):
+    # A boilerplate phrase alone is not enough, articles mention cookies and
+    # logins too; the line must also sit at a page edge or appear on other pages
+    if len(line.split()) >= 40 or BOILERPLATE.search(line) is None:
+        return False
+    return position < EDGE_LINES or position >= line_count - EDGE_LINES or normalize_text(line) in repeated
+
+
+def _paragraphs(lines):
+    # Short lines (headings, list items, definitions) stay with the text that follows them
+    pending = []
+    for line in lines:
+        pending.append(line)
+        if len(line.split()) >= MIN_PARAGRAPH_WORDS:
+            yield "\n".join(pending)
+            pending = []
+    if pending:
+        yield "\n".join(pending)
+
+
+def bm25_scores(query: str, passages, k1: float = 1.5, b: float = 0.75):
+    query_terms = set(content_terms(query))
+    documents = [Counter(content_terms(p)) for p in passages]
+    if not documents or not query_terms:
+        return [0.0] * len(documents)
+    average_length = sum(sum(d.values()) for d in documents) / len(documents) or 1
+    containing = {term: sum(1 for d in documents if term in d) for term in query_terms}
+    scores = []
+    for document in documents:
+        length = sum(document.values())
+        score = 0.0
+        for term in query_terms:
+            frequency = document.get(term, 0)
+            if not frequency:
+                continue
+            idf = math.log(1 + (len(documents) - containing[term] + 0.5) / (containing[term] + 0.5))
+            score += idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * length / average_length))
+        scores.append(score)
+    return scores
+
+
+def reduce_sources(texts, query: str, token_budget: int, max_distance: int = 3):
+    # Sources that already fit are passed through unchanged. Otherwise drops
+    # site chrome and paragraphs repeated across sources, then keeps the
+    # passages most relevant to the query (BM25) that fit the token budget.
+    # Kept passages stay in source order so the text still reads naturally.
+    texts = [text.strip() for text in texts if text and text.strip()]
+    if sum(count_tokens(text) for text in texts) <= token_budget:
+        return "\n\n".join(texts)
+
+    pages = [[line.strip() for line in text.splitlines() if line.strip()] for text in texts]
+    shared = Counter(key for lines in pages for key in {normalize_text(line) for line in lines})
+    repeated = {key for key, count in shared.items() if count > 1}
+
+    passages = []
+    seen = set()
+    fingerprints = []
+    for lines in pages:
+        kept_lines = [line for i, line in enumerate(lines) if not _is_chrome(line, i, len(lines), repeated)]
+        for paragraph in _paragraphs(kept_lines):
+            key = normalize_text(paragraph)
+            if key in seen:
+                continue
+            fingerprint = simhash(paragraph)
+            if any(hamming_distance(fingerprint, other) <= max_distance for other in fingerprints):
+                continue
+            seen.add(key)
+            fingerprints.append(fingerprint)
+            passages.append(paragraph)
+
+    tokens = [count_tokens(p) for p in passages]
+    if sum(tokens) <= token_budget:
+        return "\n\n".join(passages)
+
+    scores = bm25_scores(query, passages)
+    ranked = sorted(range(len(passages)), key=lambda i: (-scores[i], i))
+    kept = set()
+    used = 0
+    for i in ranked:
+        if used + tokens[i] <= token_budget:
+            kept.add(i)
+            used += tokens[i]
+    return "\n\n".join(passages[i] for i in sorted(kept))
@@ -0,0 +1,237 @@
+import hashlib
+import logging
+import os
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from planner import calculate_units
+from singleflight import SingleFlight
+from generator import plan_sources, generate_learning_unit_batch, stream_unit_sections, SUMMARY_BATCH_SIZE
+
+PREFETCH_AHEAD = int(os.getenv("PREFETCH_AHEAD", "2"))
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "4"))
+MAX_PROVIDERS = int(os.getenv("MAX_PROVIDERS", "256"))
+PLAN_CACHE_TTL = int(os.getenv("PLAN_CACHE_TTL", str(30 * 86400)))
+
+logger = logging.getLogger(__name__)
+
+_prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+
+
+class UnitProvider:
+    # Generates plan units on first access instead of the whole plan up front.
+    # Finished units live in the plan store, only in-flight ones are kept here.
+    def __init__(self, store, plan, sources=None):
+        self.store = store
+        self.plan = plan
+        self.plan_id = plan['id']
+        self.topic = plan['topic']
+        self.medium = plan['medium']
+        self.feedback_action = plan['feedback_action']
+        self.unit_count = plan['unit_count']
+        # Forks share their parent's sources, so its downloads are not repeated
+        self.sources = sources or plan_sources(self.topic, self.unit_count, self.medium)
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get_unit(self, unit_number):
+        unit = self._materialize(unit_number)
+        self.prefetch(unit_number)
+        return unit
+
+    def matches(self, topic, level, daily_capacity, duration, medium):
+        planned = (self.plan['topic'], self.plan['knowledge_level'], self.plan['time_capacity'],
+                   self.plan['duration'], self.plan['medium'])
+        return _normalize_params(planned) == _normalize_params((topic, level, daily_capacity, duration, medium))
+
+    def ensure_units(self, unit_numbers):
+        # Generates the given units concurrently (in batches when enabled) and
+        # waits until all of them are stored
+        batch_size = SUMMARY_BATCH_SIZE if SUMMARY_BATCH_SIZE > 1 and self.medium == "text" else 1
+        groups = [unit_numbers[k:k + batch_size] for k in range(0, len(unit_numbers), batch_size)]
+        with ThreadPoolExecutor(max_workers=max(1, len(groups))) as pool:
+            for futures in pool.map(self._generate, groups):
+                for future in futures.values():
+                    future.result()
+
+    def peek_unit(self, unit_number):
+        return self.store.load_unit(self.plan_id, unit_number)
+
+    def stream_unit(self, unit_number):
+        # Yields the unit's sections as they are generated. Generation runs in
+        # its own thread, so a closed connection does not abort it.
+        unit = self.store.load_unit(self.plan_id, unit_number)
+        if unit is not None:
+            yield from unit["sections"]
+            return
+
+        with self._lock:
+            future = self._inflight.get(unit_number)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[unit_number] = future
+
+        if not owner:
+            yield from future.result()["sections"]
+            return
+
+        # It may have been stored between the lookup above and the claim;
+        # stored units are served as immutable, so never generate them twice
+        unit = self.store.load_unit(self.plan_id, unit_number)
+        if unit is not None:
+            future.set_result(unit)
+            with self._lock:
+                self._inflight.pop(unit_number, None)
+            yield from unit["sections"]
+            return
+
+        sections = queue.Queue()
+        threading.Thread(target=self._generate_streaming, args=(unit_number, future, sections), daemon=True).start()
+        while True:
+            section = sections.get()
+            if section is None:
+                break
+            yield section
+        future.result()  # re-raises a failed generation
+        self.prefetch(unit_number)
+
+    def _generate_streaming(self, unit_number, future, sections):
+        generated = []
+        try:
+            for section in stream_unit_sections(self.topic, unit_number, medium=self.medium,
+                                                feedback_action=self.feedback_action, sources=self.sources):
+                generated.append(section)
+                sections.put(section)
+            unit = {
+                "unit_number": unit_number,
+                "title": f"{self.topic}",
+                "content": "",
+                "sections": generated,
+            }
+            self.store.save_unit(self.plan_id, unit)
+            future.set_result(unit)
+        except Exception as e:
+            logger.exception("Error streaming unit %s: %s", unit_number, e)
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._inflight.pop(unit_number, None)
+            sections.put(None)
+
+    def prefetch(self, unit_number):
+        last = min(unit_number + PREFETCH_AHEAD, self.unit_count)
+        with self._lock:
+            pending = [n for n in range(unit_number + 1, last + 1) if n not in self._inflight]
+        if not pending:
+            return
+        if SUMMARY_BATCH_SIZE > 1 and self.medium == "text":
+            # Upcoming units share one summarization request
+            _prefetch_pool.submit(self._generate, pending)
+        else:
+            for n in pending:
+                _prefetch_pool.submit(self._generate, [n])
+
+    def _materialize(self, unit_number):
+        unit = self.store.load_unit(self.plan_id, unit_number)
+        if unit is not None:
+            return unit
+        return self._generate([unit_number])[unit_number].result()
+
+    def _generate(self, unit_numbers):
+        # Claims the units nobody is generating yet and generates them in this
+        # thread; units already in flight are just waited on via their futures
+        futures = {}
+        claimed = []
+        with self._lock:
+            for n in unit_numbers:
+                future = self._inflight.get(n)
+                if future is None:
+                    future = Future()
+                    self._inflight[n] = future
+                    claimed.append(n)
+                futures[n] = future
+
+        if claimed:
+            try:
+                todo = []
+                for n in claimed:
+                    unit = self.store.load_unit(self.plan_id, n)
+                    if unit is None:
+                        todo.append(n)
+                    else:
+                        futures[n].set_result(unit)
+                if todo:
+                    for unit in generate_learning_unit_batch(self.topic, todo, medium=self.medium,
+                                                             feedback_action=self.feedback_action,
+                                                             sources=self.sources):
+                        self.store.save_unit(self.plan_id, unit)
+                        futures[unit["unit_number"]].set_result(unit)
+            except Exception as e:
+                logger.exception("Error generating units %s: %s", claimed, e)
+                for n in claimed:
+                    if not futures[n].done():
+                        futures[n].set_exception(e)
+            finally:
+                with self._lock:
+                    for n in claimed:
+                        self._inflight.pop(n, None)
+        return futures
+
+
+# -------------------------- Provider registry --------------------------
+_providers = OrderedDict()
+_providers_lock = threading.Lock()
+
+_plan_flight = SingleFlight()
+
+def _normalize_params(params):
+    return tuple(" ".join(str(p or "").split()).lower() for p in params)
+
+def make_plan_key(topic, level, daily_capacity, duration, medium, feedback_action):
+    normalized = "|".join(_normalize_params((topic, level, daily_capacity, duration, medium, feedback_action)))
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+def find_or_create_plan(store, topic, level, daily_capacity, duration, medium="text", feedback_action="great"):
+    # Identical parameters map to one shared plan; concurrent first requests
+    # wait on a single lookup instead of creating duplicates
+    unit_count = calculate_units(level, daily_capacity, duration)
+    plan_key = make_plan_key(topic, level, daily_capacity, duration, medium, feedback_action)
+    return _plan_flight.do(plan_key, lambda: store.get_or_create_plan(
+        plan_key, topic, level, daily_capacity, duration, medium, feedback_action, unit_count, PLAN_CACHE_TTL))
+
+def make_fork_key(parent_id, feedback_action, keep_through):
+    normalized = "|".join(("fork", parent_id, feedback_action, str(keep_through)))
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+def fork_plan(store, provider, feedback_action, keep_through):
+    # Regenerates only the units after keep_through at the new difficulty.
+    # The same feedback on the same unit of a plan maps to one shared fork.
+    if feedback_action == provider.feedback_action:
+        return provider.plan_id
+    fork_key = make_fork_key(provider.plan_id, feedback_action, keep_through)
+    return _plan_flight.do(fork_key, lambda: store.fork_plan(
+        fork_key, provider.plan_id, feedback_action, keep_through, PLAN_CACHE_TTL))
+
+def get_provider(store, plan_id):
+    if not plan_id:
+        return None
+    with _providers_lock:
+        provider = _providers.get(plan_id)
+        if provider is not None:
+            _providers.move_to_end(plan_id)
+            return provider
+
+    # Not cached in this process (e.g. after a restart): rebuild from the store
+    plan = store.get_plan(plan_id)
+    if plan is None:
+        return None
+    with _providers_lock:
+        parent = _providers.get(plan['parent_id']) if plan['parent_id'] else None
+    sources = parent.sources if parent is not None else None
+    with _providers_lock:
+        provider = _providers.setdefault(plan_id, UnitProvider(store, plan, sources))
+        while len(_providers) > MAX_PROVIDERS:
+            _providers.popitem(last=False)
+    return provider
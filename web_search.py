@@ -1,127 +1,282 @@
-import requests
-from dotenv import load_dotenv
-import os
-from serpapi import GoogleSearch  # Make sure you pip install serpapi
-import trafilatura
-
-load_dotenv()  # Load variables from .env
-SERP_API_KEY = os.getenv("SERPAPI_KEY")
-
-
-
-def search_web_snippets(query, max_results=2):
-    url = "https://serpapi.com/search"
-    params = {
-        "q": query,
-        "api_key": SERP_API_KEY,
-        "engine": "google",
-        "num": max_results
-    }
-    try:
-        response = requests.get(url, params=params)
-        data = response.json()
-        results = data.get("organic_results", [])[:max_results]
-        return [r.get("snippet", "") for r in results if r.get("snippet")]
-    except Exception as e:
-        return [f"Error fetching search results: {e}"]
-    
-
-
-def search_web_pages(query, max_results=2):
-    params = {
-        "q": query,
-        "api_key": SERP_API_KEY,
-        "engine": "google",
-        "num": max_results
-    }
-    search = GoogleSearch(params)
-    results = search.get_dict()
-
-    links = []
-    for result in results.get("organic_results", []):
-        link = result.get("link")
-        if link:
-            links.append(link)
-    return links
-
-
-def extract_clean_text(url):
-    downloaded = trafilatura.fetch_url(url)
-    if downloaded:
-        return trafilatura.extract(downloaded)
-    return ""
-
-    
-def fetch_youtube_videos(topic, target_duration=3600, max_results=2):
-    import requests
-    from dotenv import load_dotenv
-    import os
-
-    load_dotenv()
-    SERP_API_KEY = os.getenv("SERPAPI_KEY")
-
-    url = "https://serpapi.com/search"
-    params = {
-        "engine": "youtube",
-        "search_query": topic,
-        "api_key": SERP_API_KEY,
-    }
-    try:
-        response = requests.get(url, params=params)
-        data = response.json()
-        items = data.get("video_results", [])[:max_results]
-
-        results = []
-        total_duration = 0
-
-        def parse_duration(duration_str):
-            parts = list(map(int, duration_str.split(":")))
-            if len(parts) == 3:
-                return parts[0] * 3600 + parts[1] * 60 + parts[2]
-            elif len(parts) == 2:
-                return parts[0] * 60 + parts[1]
-            elif len(parts) == 1:
-                return parts[0]
-            else:
-                return 0
-
-        for item in items:
-            title = item.get("title")
-            link = item.get("link")
-            duration_str = item.get("length")
-
-            if not title or not link or not duration_str:
-                continue
-
-            duration_sec = parse_duration(duration_str)
-
-            # Skip videos longer than target duration
-            if duration_sec > target_duration:
-                continue
-
-            # Stop if adding this would exceed the limit
-            if total_duration + duration_sec > target_duration:
-                continue
-
-            results.append({
-                "title": title,
-                "link": link,
-                "duration": duration_str
-            })
-            total_duration += duration_sec
-
-            if total_duration >= target_duration:
-                break
-
-        return results
-
-    except Exception as e:
-        return [{"title": "Error", "link": "", "duration": str(e)}]
-
-if __name__ == "__main__":
-    from web_search import fetch_youtube_videos
-    videos = fetch_youtube_videos("AI ethics", target_duration=3600)        
-    total = 0
-    for v in videos:
-        print(f"{v['title']} – {v['duration']} – {v['link']}")
+import hashlib
+import logging
+from dotenv import load_dotenv
+import os
+from urllib.parse import urlsplit, urlunsplit
+import trafilatura
+
+from response_cache import ResponseCache
+from page_cache import PageCache
+from article_index import ArticleIndex
+from rate_limiter import get_scheduler
+from http_client import get_http_session, HTTP_TIMEOUT
+from metrics import span, timed
+
+load_dotenv()  # Load variables from .env
+SERP_API_KEY = os.getenv("SERPAPI_KEY")
+
+# Local cache for SerpAPI responses, shared by all search functions
+SERP_CACHE = ResponseCache(
+    os.getenv("SERP_CACHE_PATH", os.path.join("mnt", "data", "serp_cache.db")),
+    table="serp_responses",
+    ttl=int(os.getenv("SERP_CACHE_TTL", "86400")),
+    max_entries=int(os.getenv("SERP_CACHE_MAX_ENTRIES", "10000")),
+)
+
+# Downloaded pages and their extracted text
+PAGE_CACHE = PageCache(
+    os.getenv("PAGE_CACHE_PATH", os.path.join("mnt", "data", "page_cache.db")),
+    max_age=int(os.getenv("PAGE_CACHE_MAX_AGE", str(7 * 86400))),
+    max_bytes=int(os.getenv("PAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+)
+# Full-text index over every extracted article, searched before SerpAPI
+ARTICLE_INDEX = ArticleIndex(
+    os.getenv("ARTICLE_INDEX_PATH", os.path.join("mnt", "data", "article_index.db")),
+    max_age=int(os.getenv("ARTICLE_INDEX_MAX_AGE", str(30 * 86400))),
+)
+PAGE_TIMEOUT = int(os.getenv("PAGE_TIMEOUT", "30"))
+# Same size limit trafilatura.fetch_url applies; larger pages are not downloaded
+PAGE_DOWNLOAD_MAX_BYTES = int(os.getenv("PAGE_DOWNLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+PAGE_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+PAGE_USER_AGENT = "Mozilla/5.0 (compatible; learning_agent)"
+
+logger = logging.getLogger(__name__)
+
+
+def _cached_search(params, fetch):
+    key = SERP_CACHE.make_key(params)
+    data = SERP_CACHE.get(key)
+    if data is None:
+        # Throttled and retried with the other SerpAPI calls
+        with span("serpapi_request", engine=params.get("engine", "google")):
+            data = get_scheduler("serpapi").call(fetch, params)
+        # Error responses are returned but never cached
+        if data and "error" not in data:
+            SERP_CACHE.set(key, data)
+    return data
+
+
+def _fetch_serpapi_json(params):
+    response = get_http_session().get("https://serpapi.com/search", params=params, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()  # 429/5xx are retried by the scheduler
+    return response.json()
+
+
+
+def search_web_snippets(query, max_results=2):
+    params = {
+        "q": query,
+        "api_key": SERP_API_KEY,
+        "engine": "google",
+        "num": max_results
+    }
+    try:
+        data = _cached_search(params, _fetch_serpapi_json)
+        results = data.get("organic_results", [])[:max_results]
+        return [r.get("snippet", "") for r in results if r.get("snippet")]
+    except Exception as e:
+        logger.warning("Error fetching search results: %s", e)
+        return []
+    
+
+
+@timed("search_pages")
+def search_web_pages(query, max_results=2, start=0):
+    params = {
+        "q": query,
+        "api_key": SERP_API_KEY,
+        "engine": "google",
+        "num": max_results
+    }
+    if start:
+        params["start"] = start
+    results = _cached_search(params, _fetch_serpapi_json)
+
+    links = []
+    for result in results.get("organic_results", []):
+        link = result.get("link")
+        if link:
+            links.append(link)
+    return links
+
+
+def normalize_url(url):
+    parts = urlsplit(url.strip())
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, parts.query, ""))
+
+
+@timed("search_source_pool")
+def search_source_pool(query, pool_size, page_size=10):
+    # Pages through the results once and keeps every distinct URL
+    links = []
+    seen = set()
+    start = 0
+    while len(links) < pool_size:
+        page = search_web_pages(query, max_results=page_size, start=start)
+        new_links = 0
+        for link in page:
+            key = normalize_url(link)
+            if key not in seen:
+                seen.add(key)
+                links.append(link)
+                new_links += 1
+        if not new_links:
+            break
+        start += page_size
+    return links[:pool_size]
+
+
+def _read_html(url, response):
+    # Body of an HTML page, or None when the response is not one or is over
+    # PAGE_DOWNLOAD_MAX_BYTES; read in chunks so an oversized page is dropped early
+    if response.status_code != 200:
+        return None
+    content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+    if content_type and content_type not in PAGE_CONTENT_TYPES:
+        logger.info("Skipping %s: content type %s", url, content_type)
+        return None
+    length = response.headers.get("Content-Length")
+    if length and length.isdigit() and int(length) > PAGE_DOWNLOAD_MAX_BYTES:
+        logger.info("Skipping %s: %s bytes", url, length)
+        return None
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(chunk_size=64 * 1024):
+        size += len(chunk)
+        if size > PAGE_DOWNLOAD_MAX_BYTES:
+            logger.info("Skipping %s: larger than %d bytes", url, PAGE_DOWNLOAD_MAX_BYTES)
+            return None
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+@timed("extract_clean_text")
+def extract_clean_text(url):
+    entry = PAGE_CACHE.get(url)
+    if entry and entry["fresh"]:
+        return entry["text"]
+
+    # Stale entries are revalidated instead of downloaded again
+    headers = {"User-Agent": PAGE_USER_AGENT}
+    if entry:
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    try:
+        with span("page_download"):
+            response = get_http_session().get(url, headers=headers, timeout=PAGE_TIMEOUT, stream=True)
+            try:
+                html = _read_html(url, response)
+            finally:
+                response.close()
+    except Exception as e:
+        logger.warning("Error downloading %s: %s", url, e)
+        return entry["text"] if entry else ""
+
+    if entry and response.status_code == 304:
+        PAGE_CACHE.mark_fresh(url)
+        return entry["text"]
+    if not html:
+        return entry["text"] if entry else ""
+
+    content_hash = hashlib.sha256(html).hexdigest()
+    text = PAGE_CACHE.text_for_hash(content_hash)
+    if text is None:
+        with span("trafilatura_extract"):
+            text = trafilatura.extract(html) or ""
+    PAGE_CACHE.put(url, html, text, content_hash,
+                   etag=response.headers.get("ETag"),
+                   last_modified=response.headers.get("Last-Modified"))
+    ARTICLE_INDEX.add(url, text, content_hash)
+    return text
+
+    
+def parse_video_duration(duration_str):
+    try:
+        parts = list(map(int, duration_str.split(":")))
+    except (AttributeError, ValueError):
+        return 0
+    if len(parts) == 3:
+        return parts[0] * 3600 + parts[1] * 60 + parts[2]
+    elif len(parts) == 2:
+        return parts[0] * 60 + parts[1]
+    elif len(parts) == 1:
+        return parts[0]
+    else:
+        return 0
+
+
+@timed("search_youtube")
+def search_youtube_page(query, page_token=None):
+    # One page of YouTube results plus the token for the next page (None on the last one)
+    params = {
+        "engine": "youtube",
+        "search_query": query,
+        "api_key": SERP_API_KEY,
+    }
+    if page_token:
+        params["sp"] = page_token
+    data = _cached_search(params, _fetch_serpapi_json)
+
+    videos = []
+    for item in data.get("video_results", []):
+        title = item.get("title")
+        link = item.get("link")
+        duration_str = item.get("length")
+        if not title or not link or not duration_str:
+            continue
+        videos.append({
+            "title": title,
+            "link": link,
+            "duration": duration_str,
+            "seconds": parse_video_duration(duration_str),
+        })
+    return videos, data.get("serpapi_pagination", {}).get("next_page_token")
+
+
+def pack_videos(videos, bin_count, target_duration=3600):
+    # Best-fit decreasing: longest videos first, each into the unit whose
+    # remaining time it fills most tightly. Videos keep their search order
+    # inside a unit.
+    seen = set()
+    candidates = []
+    for rank, video in enumerate(videos):
+        key = normalize_url(video["link"])
+        if key in seen or not 0 < video["seconds"] <= target_duration:
+            continue
+        seen.add(key)
+        candidates.append((rank, video))
+    candidates.sort(key=lambda c: c[1]["seconds"], reverse=True)
+
+    bins = [[] for _ in range(bin_count)]
+    remaining = [target_duration] * bin_count
+    for rank, video in candidates:
+        best = None
+        for b in range(bin_count):
+            if video["seconds"] <= remaining[b] and (best is None or remaining[b] < remaining[best]):
+                best = b
+        if best is not None:
+            bins[best].append((rank, video))
+            remaining[best] -= video["seconds"]
+
+    return [[video for _, video in sorted(packed, key=lambda c: c[0])] for packed in bins]
+
+
+def fetch_youtube_videos(topic, target_duration=3600, max_results=2):
+    try:
+        videos, _ = search_youtube_page(topic)
+        return pack_videos(videos, 1, target_duration)[0][:max_results]
+    except Exception as e:
+        logger.warning("Error fetching YouTube videos: %s", e)
+        return []
+
+if __name__ == "__main__":
+    from web_search import fetch_youtube_videos
+    videos = fetch_youtube_videos("AI ethics", target_duration=3600)        
+    total = 0
+    for v in videos:
+        print(f"{v['title']} – {v['duration']} – {v['link']}")
     print(f"Total videos: {len(videos)}")       
\ No newline at end of file